@@ -1,141 +1,274 @@
-import weaviate
-from pymongo import MongoClient
-import ollama
-import os
+from weaviate.classes.data import DataObject
+from pymongo import MongoClient, ASCENDING
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import threading
 import time
+from services.embeddings import get_provider
+from services.review_schema import REVIEW_COLLECTION, apply_tuning, ensure_review_collection, review_properties, review_uuid, to_geo_coordinate
+from services.weaviate_pool import WeaviatePool, connect
 
-def backfill_reviews():
+# Per-partition high-water marks; a rerun continues from these
+CHECKPOINT_COLLECTION = "backfill_checkpoints"
+REVIEW_PROJECTION = {"text": 1, "business_id": 1, "location": 1}
+
+
+class RateLimiter:
+    """Token bucket shared by all workers; rate <= 0 disables limiting."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._allowance = rate
+        self._last = time.monotonic()
+
+    def acquire(self, n):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                # Batches larger than one second's budget go through once the bucket is full
+                if self._allowance >= min(n, self.rate):
+                    self._allowance -= n
+                    return
+                wait = (min(n, self.rate) - self._allowance) / self.rate
+            time.sleep(wait)
+
+
+class Progress:
+    def __init__(self, total, already):
+        self._lock = threading.Lock()
+        self.total = total
+        self.processed = already
+        self.started = time.monotonic()
+        self.session = 0
+
+    def add(self, n):
+        with self._lock:
+            self.processed += n
+            self.session += n
+            rate = self.session / (time.monotonic() - self.started)
+            print(f"Processed {self.processed}/{self.total} reviews ({rate:.0f}/s)...", end='\r')
+
+
+def plan_partitions(db, partitions):
+    """
+    Split reviews into `partitions` contiguous _id ranges using a random
+    sample for split points (no full scan), and persist them as checkpoints.
+    """
+    checkpoints = db[CHECKPOINT_COLLECTION]
+    existing = list(checkpoints.find({"collection": "reviews"}).sort("index", ASCENDING))
+    if existing:
+        print(f"Resuming {len(existing)} saved partitions.")
+        return existing
+
+    sample_size = partitions * 50
+    sample = sorted({d["_id"] for d in db.reviews.aggregate([
+        {"$sample": {"size": sample_size}},
+        {"$project": {"_id": 1}}
+    ])})
+    step = max(1, len(sample) // partitions)
+    bounds = [None] + sample[step::step][:partitions - 1] + [None]
+    plan = []
+    for i in range(len(bounds) - 1):
+        plan.append({
+            "_id": f"reviews:{i}",
+            "collection": "reviews",
+            "index": i,
+            "lower": bounds[i],
+            "upper": bounds[i + 1],
+            "high_water": None,
+            "processed": 0,
+            "done": False,
+        })
+    if plan:
+        checkpoints.insert_many(plan)
+    print(f"Planned {len(plan)} partitions by _id.")
+    return plan
+
+
+def partition_query(partition):
+    id_range = {}
+    if partition["high_water"] is not None:
+        id_range["$gt"] = partition["high_water"]
+    elif partition["lower"] is not None:
+        id_range["$gte"] = partition["lower"]
+    if partition["upper"] is not None:
+        id_range["$lt"] = partition["upper"]
+    return {"_id": id_range} if id_range else {}
+
+
+def backfill_partition(db, pool, partition, batch_size, limiter, progress):
+    checkpoints = db[CHECKPOINT_COLLECTION]
+    cursor = db.reviews.find(partition_query(partition), REVIEW_PROJECTION).sort("_id", ASCENDING)
+
+    def flush(batch_docs, last_id):
+        docs = [d for d in batch_docs if d.get("text")]
+        if docs:
+            limiter.acquire(len(docs))
+            vectors = get_provider().embed([d["text"] for d in docs])
+            objects = [
+                DataObject(uuid=review_uuid(d["_id"]), properties=review_properties(d), vector=vectors[i])
+                for i, d in enumerate(docs)
+            ]
+            with pool.client() as w_client:
+                result = w_client.collections.get(REVIEW_COLLECTION).data.insert_many(objects)
+            if result.errors:
+                raise RuntimeError(f"{len(result.errors)} objects failed to insert, e.g. "
+                                   f"{next(iter(result.errors.values())).message}")
+        # Only advance the high-water mark once the batch is in Weaviate;
+        # empty-text reviews are stepped over rather than counted
+        checkpoints.update_one(
+            {"_id": partition["_id"]},
+            {"$set": {"high_water": last_id}, "$inc": {"processed": len(docs)}}
+        )
+        progress.add(len(docs))
+
+    batch_docs = []
+    for doc in cursor:
+        batch_docs.append(doc)
+        if len(batch_docs) >= batch_size:
+            flush(batch_docs, doc["_id"])
+            batch_docs = []
+    if batch_docs:
+        flush(batch_docs, batch_docs[-1]["_id"])
+
+    checkpoints.update_one({"_id": partition["_id"]}, {"$set": {"done": True}})
+
+
+def backfill_reviews(workers=4, partitions=32, batch_size=256, rate=0.0, reset=False):
     print("Connecting to MongoDB...")
     mongo_client = MongoClient("mongodb://localhost:27017")
     db = mongo_client.yelp_data
-    reviews_collection = db.reviews
 
     print("Connecting to Weaviate...")
-    w_client = weaviate.connect_to_local(
-        port=8080,
-        grpc_port=50051, 
-        headers={}
-    )
+    pool = WeaviatePool(size=workers, acquire_timeout=None)
+    pool.open()
 
-    print("Using Ollama for embeddings (model: all-minilm)...")
-    # Ensure user has run: ollama pull all-minilm
+    # With the default Ollama backend, ensure user has run: ollama pull all-minilm
+    print(f"Using embeddings from {get_provider().name}...")
 
     try:
         # Create collection if not exists (DO NOT DELETE if resuming)
-        if not w_client.collections.exists("Review"):
-            from weaviate.classes.config import Configure
-            w_client.collections.create(
-                "Review",
-                vectorizer_config=Configure.Vectorizer.none()
-            )
-            print("Created 'Review' collection in Weaviate.")
-        else:
-            print("Collection 'Review' already exists. Checking for resume...")
-        
-        w_reviews = w_client.collections.get("Review")
-
-    except Exception as e:
-        print(f"Error setting up collection: {e}")
-        # Fallback or exit?
-        try:
-            w_reviews = w_client.collections.get("Review")
-        except:
-            print("Critical error: Could not access 'Review' collection.")
-            return
+        with pool.client() as w_client:
+            ensure_review_collection(w_client)
 
-    # Check existing count to RESUME
-    try:
-        current_count = w_reviews.aggregate.over_all(total_count=True).total_count
-        print(f"Current Weaviate count: {current_count}")
-    except:
-        current_count = 0
-
-    total_reviews = reviews_collection.count_documents({})
-    print(f"Found {total_reviews} reviews in MongoDB.")
-
-    print(f"Found {total_reviews} reviews in MongoDB.")
-    
-    if current_count > 0:
-        print(f"Resuming backfill... Skipping first {current_count} reviews.")
-    
-    # Skip existing
-    cursor = reviews_collection.find({}).skip(current_count)
-    
-    batch_size = 10 # Drastically reduced batch size
-    processed = current_count
-
-    print("Starting backfill with batching...")
-    start_time = time.time()
-    
-    batch_docs = []
-    
-    with w_reviews.batch.dynamic() as batch:
-        for doc in cursor:
-            review_text = doc.get("text", "")
-            if not review_text:
-                continue
-            
-            batch_docs.append(doc)
-            
-            if len(batch_docs) >= batch_size:
-                texts = [d["text"] for d in batch_docs]
-                
+        if reset:
+            db[CHECKPOINT_COLLECTION].delete_many({"collection": "reviews"})
+            print("Cleared saved partitions.")
+
+        plan = plan_partitions(db, partitions)
+        pending = [p for p in plan if not p["done"]]
+        already = sum(p["processed"] for p in plan)
+
+        total_reviews = db.reviews.estimated_document_count()
+        print(f"Found ~{total_reviews} reviews in MongoDB; {already} already indexed, "
+              f"{len(pending)}/{len(plan)} partitions remaining.")
+
+        limiter = RateLimiter(rate)
+        progress = Progress(total_reviews, already)
+        failed = 0
+        print(f"Starting backfill with {workers} workers, batch size {batch_size}"
+              + (f", target {rate:.0f} reviews/s" if rate > 0 else "") + "...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(backfill_partition, db, pool, p, batch_size, limiter, progress): p
+                for p in pending
+            }
+            for future in as_completed(futures):
                 try:
-                    # Ollama embed API
-                    response = ollama.embed(model='all-minilm', input=texts)
-                    vectors = response['embeddings']
-                    
-                    for i, d in enumerate(batch_docs):
-                        batch.add_object(
-                            properties={
-                                "review_id": str(d["_id"]),
-                                "business_id": d["business_id"],
-                                "text": d["text"]
-                            },
-                            vector=vectors[i]
-                        )
-                    
-                    processed += len(batch_docs)
-                    batch_docs = []
-                    print(f"Processed {processed}/{total_reviews} reviews...", end='\r')
-                    
-                    # Rate limiting to let Weaviate catch up/flush
-                    time.sleep(0.5) 
-                    
+                    future.result()
                 except Exception as e:
-                    print(f"\nError generating embeddings with Ollama: {e}")
-                    # If error, try to continue with next batch? Or stop?
-                    # Let's stop to avoid skipping data without inserting
-                    return
+                    # Partition keeps its last high-water mark; rerun to resume it
+                    failed += 1
+                    print(f"\nError in partition {futures[future]['index']}: {e}")
 
-        # Process remaining
-        if batch_docs:
-            texts = [d["text"] for d in batch_docs]
-            try:
-                response = ollama.embed(model='all-minilm', input=texts)
-                vectors = response['embeddings']
-                for i, d in enumerate(batch_docs):
-                    batch.add_object(
-                        properties={
-                            "review_id": str(d["_id"]),
-                            "business_id": d["business_id"],
-                            "text": d["text"]
-                        },
-                        vector=vectors[i]
-                    )
-                processed += len(batch_docs)
-            except Exception as e:
-                print(f"Error generating embeddings: {e}")
-
-        print(f"\nBackfill complete! Processed {processed} reviews.")
+        if failed:
+            print(f"\n{failed} partitions failed; rerun to resume them.")
+        else:
+            print(f"\nBackfill complete! Processed {progress.processed} reviews.")
+            # Collections are created uncompressed; PQ trains on what was just loaded
+            with pool.client() as w_client:
+                apply_tuning(w_client)
 
         # Verification
         print("\nVerifying Weaviate count...")
-        count = w_reviews.aggregate.over_all(total_count=True).total_count
-        print(f"Total objects in Weaviate 'Review' collection: {count}")
+        with pool.client() as w_client:
+            count = w_client.collections.get(REVIEW_COLLECTION).aggregate.over_all(total_count=True).total_count
+        print(f"Total objects in Weaviate '{REVIEW_COLLECTION}' collection: {count}")
+    finally:
+        pool.close()
+        mongo_client.close()
+
+def backfill_review_locations(batch_size):
+    """
+    Add the 'location' geo property to Review objects indexed before it existed,
+    using each review's business location from MongoDB. Objects are re-inserted
+    in batches under the same UUID, with their vector, which replaces them whole.
+    """
+    mongo_client = MongoClient("mongodb://localhost:27017")
+    db = mongo_client.yelp_data
+    w_client = connect()
 
-    w_client.close()
-    mongo_client.close()
+    try:
+        w_reviews = ensure_review_collection(w_client)
+        locations = {}
+        updated = 0
+        scanned = 0
+        batch = []
+
+        def flush():
+            nonlocal updated
+            missing = {obj.properties.get("business_id") for obj in batch} - locations.keys()
+            if missing:
+                found = {
+                    b["business_id"]: to_geo_coordinate(b.get("location"))
+                    for b in db.businesses.find({"business_id": {"$in": list(missing)}}, {"business_id": 1, "location": 1})
+                }
+                locations.update({bid: found.get(bid) for bid in missing})
+            objects = [
+                DataObject(
+                    uuid=obj.uuid,
+                    properties={**obj.properties, "location": locations[obj.properties.get("business_id")]},
+                    vector=obj.vector["default"]
+                )
+                for obj in batch if locations.get(obj.properties.get("business_id")) is not None
+            ]
+            if objects:
+                result = w_reviews.data.insert_many(objects)
+                updated += len(objects) - len(result.errors)
+                if result.errors:
+                    print(f"\n{len(result.errors)} location updates failed: "
+                          f"{next(iter(result.errors.values())).message}")
+            batch.clear()
+
+        for obj in w_reviews.iterator(include_vector=True):
+            scanned += 1
+            if obj.properties.get("location"):
+                continue
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                flush()
+                print(f"Scanned {scanned}, updated {updated}...", end='\r')
+        flush()
+        print(f"\nLocation backfill complete. Scanned {scanned}, updated {updated}.")
+    finally:
+        w_client.close()
+        mongo_client.close()
 
 if __name__ == "__main__":
-    backfill_reviews()
+    parser = argparse.ArgumentParser(description="Backfill MongoDB reviews into Weaviate")
+    parser.add_argument("--workers", type=int, default=4, help="partitions processed concurrently")
+    parser.add_argument("--partitions", type=int, default=32, help="_id ranges to split reviews into")
+    parser.add_argument("--batch-size", type=int, default=256, help="reviews per embedding call")
+    parser.add_argument("--rate", type=float, default=0.0, help="target reviews/s (0 = unlimited)")
+    parser.add_argument("--reset", action="store_true", help="discard saved partitions and start over")
+    parser.add_argument("--locations", action="store_true", help="only add 'location' to existing objects")
+    args = parser.parse_args()
+    if args.locations:
+        backfill_review_locations(args.batch_size)
+    else:
+        backfill_reviews(args.workers, args.partitions, args.batch_size, args.rate, args.reset)
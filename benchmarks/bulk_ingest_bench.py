@@ -0,0 +1,75 @@
+"""
+Review ingestion throughput: POST /add_review per review vs. POST /reviews:bulk.
+Runs against a live API (uvicorn main:app) and writes real reviews, so point
+it at a test deployment.
+
+    python -m benchmarks.bulk_ingest_bench --url http://localhost:8000 --reviews 2000
+"""
+import argparse
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+from pymongo import MongoClient
+
+
+def post(url, body, content_type="application/json"):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return orjson.loads(response.read())
+
+
+def make_reviews(business_ids, n):
+    return [{
+        "business_id": random.choice(business_ids),
+        "user_id": f"bench-user-{i}",
+        "stars": float(random.randint(1, 5)),
+        "text": f"Benchmark review {i}",
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    } for i in range(n)]
+
+
+def run(label, fn, n):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {n / elapsed:9.1f} reviews/s  ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--reviews", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--chunk", type=int, default=1000, help="reviews per bulk request")
+    args = parser.parse_args()
+
+    mongo_client = MongoClient("mongodb://localhost:27017")
+    business_ids = [b["business_id"] for b in mongo_client.yelp_data.businesses.aggregate([
+        {"$sample": {"size": 200}}, {"$project": {"business_id": 1}}
+    ])]
+    mongo_client.close()
+
+    single = make_reviews(business_ids, args.reviews)
+    def single_path():
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda r: post(f"{args.url}/add_review", orjson.dumps(r)), single))
+    run(f"/add_review x{args.concurrency} threads", single_path, args.reviews)
+
+    bulk = make_reviews(business_ids, args.reviews)
+    def bulk_path():
+        for i in range(0, len(bulk), args.chunk):
+            result = post(f"{args.url}/reviews:bulk", orjson.dumps(bulk[i:i + args.chunk]))
+            if result["failed"]:
+                print(f"  {result['failed']} reviews failed in chunk {i // args.chunk}")
+    run(f"/reviews:bulk ({args.chunk}/request)", bulk_path, args.reviews)
+
+    ndjson = b"\n".join(orjson.dumps(r) for r in make_reviews(business_ids, args.reviews))
+    run("/reviews:bulk (one NDJSON stream)",
+        lambda: post(f"{args.url}/reviews:bulk", ndjson, "application/x-ndjson"), args.reviews)
+
+
+if __name__ == "__main__":
+    main()
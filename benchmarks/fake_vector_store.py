@@ -0,0 +1,140 @@
+"""
+In-process stand-in for Weaviate, for benchmarks/loadtest.py only: the API
+serves it when started with VECTOR_STORE=fake. Not for production use; it
+supports just the query calls routes/semantic.py makes.
+"""
+import asyncio
+import os
+import threading
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+from pymongo import MongoClient
+
+from services.embeddings import FakeProvider
+
+# Reviews loaded into the in-memory index (most recent _id first)
+FAKE_VECTOR_STORE_SIZE = int(os.environ.get("FAKE_VECTOR_STORE_SIZE", "200000"))
+EARTH_RADIUS_M = 6371000.0
+
+
+class _Index:
+    """
+    Brute-force stand-in for the Review collection: reviews from MongoDB,
+    embedded with FakeProvider into one normalized float32 matrix. Cosine
+    scores serve near_vector; with hashed bag-of-words vectors the same dot
+    product is a term-overlap score, which stands in for BM25.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+            from database import MONGO_URI
+            mongo_client = MongoClient(MONGO_URI)
+            try:
+                docs = list(mongo_client.yelp_data.reviews.find(
+                    {"text": {"$nin": ["", None]}},
+                    {"text": 1, "business_id": 1, "location": 1}
+                ).sort("_id", -1).limit(FAKE_VECTOR_STORE_SIZE))
+            finally:
+                mongo_client.close()
+            provider = FakeProvider()
+            self.vectors = np.array(provider.embed([d["text"] for d in docs]), dtype=np.float32).reshape(-1, provider.dimensions)
+            self.properties = [
+                {"review_id": str(d["_id"]), "business_id": d["business_id"], "text": d["text"]}
+                for d in docs
+            ]
+            self.uuids = [uuid.uuid5(uuid.NAMESPACE_URL, p["review_id"]) for p in self.properties]
+            self.business_ids = np.array([d["business_id"] for d in docs], dtype=object)
+            coordinates = [(d.get("location") or {}).get("coordinates") or [np.nan, np.nan] for d in docs]
+            self.lons = np.radians(np.array([c[0] for c in coordinates], dtype=np.float64))
+            self.lats = np.radians(np.array([c[1] for c in coordinates], dtype=np.float64))
+            self.loaded = True
+            print(f"Fake vector store loaded {len(docs)} reviews.")
+
+    def mask(self, filters):
+        """Boolean mask for the subset of Weaviate filters semantic search uses."""
+        if filters is None:
+            return np.ones(len(self.properties), dtype=bool)
+        if hasattr(filters, "filters"):
+            # Filter.all_of(...)
+            mask = np.ones(len(self.properties), dtype=bool)
+            for f in filters.filters:
+                mask &= self.mask(f)
+            return mask
+        value = filters.value
+        if hasattr(value, "distance"):
+            # within_geo_range
+            lat, lon = np.radians(value.latitude), np.radians(value.longitude)
+            a = (np.sin((self.lats - lat) / 2) ** 2
+                 + np.cos(lat) * np.cos(self.lats) * np.sin((self.lons - lon) / 2) ** 2)
+            return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0))) <= value.distance
+        if isinstance(value, (list, tuple)) and filters.target == "business_id":
+            return np.isin(self.business_ids, list(value))
+        raise ValueError(f"Fake vector store does not support filter on {filters.target!r}: {filters!r}")
+
+    def search(self, scores, filters, limit, metadata):
+        candidates = np.flatnonzero(self.mask(filters))
+        if len(candidates) == 0:
+            return SimpleNamespace(objects=[])
+        top = candidates[np.argsort(-scores[candidates], kind="stable")[:limit]]
+        return SimpleNamespace(objects=[
+            SimpleNamespace(
+                uuid=self.uuids[i],
+                properties=self.properties[i],
+                metadata=SimpleNamespace(**{metadata: float(1.0 - scores[i]) if metadata == "distance" else float(scores[i])})
+            )
+            for i in top
+        ])
+
+
+_index = _Index()
+_provider = FakeProvider()
+
+
+class _Query:
+    async def near_vector(self, near_vector, limit=10, filters=None, **kwargs):
+        scores = _index.vectors @ np.asarray(near_vector, dtype=np.float32)
+        return _index.search(scores, filters, limit, "distance")
+
+    async def bm25(self, query, limit=10, filters=None, **kwargs):
+        scores = _index.vectors @ np.asarray(_provider.embed_one(query), dtype=np.float32)
+        return _index.search(scores, filters, limit, "score")
+
+    async def hybrid(self, query, vector=None, alpha=0.5, limit=10, filters=None, **kwargs):
+        keyword = _index.vectors @ np.asarray(_provider.embed_one(query), dtype=np.float32)
+        semantic = _index.vectors @ np.asarray(vector, dtype=np.float32) if vector is not None else keyword
+        return _index.search(alpha * semantic + (1 - alpha) * keyword, filters, limit, "score")
+
+
+class _Collection:
+    def __init__(self):
+        self.query = _Query()
+
+
+class _Collections:
+    def get(self, name):
+        return _Collection()
+
+
+class FakeAsyncClient:
+    """Async Weaviate client stand-in for AsyncWeaviatePool (VECTOR_STORE=fake)."""
+
+    def __init__(self):
+        self.collections = _Collections()
+
+    async def connect(self):
+        # Shared by every pooled client; loaded once per process
+        await asyncio.to_thread(_index.load)
+
+    async def is_ready(self):
+        return True
+
+    async def close(self):
+        pass
@@ -0,0 +1,387 @@
+"""
+Mixed-workload load test for the API, with a reproducible local setup.
+
+Seed a single local mongod (not the cluster: --drop clears yelp_data there)
+with synthetic businesses clustered around a few city centers and reviews
+spread over them with Zipfian popularity:
+
+    docker run -d -p 27017:27017 mongo
+    python -m benchmarks.loadtest seed --uri mongodb://localhost:27017 --drop
+
+Run the workload against an API it starts itself with the deterministic
+stand-ins (EMBEDDING_BACKEND=fake, VECTOR_STORE=fake), or against any running
+deployment with --url:
+
+    python -m benchmarks.loadtest run --spawn --duration 60 --concurrency 32
+    python -m benchmarks.loadtest run --url http://localhost:8000 --json report.json
+
+Reports requests/s and p50/p95/p99 latency per route.
+"""
+import argparse
+import bisect
+import http.client
+import itertools
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import orjson
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, MongoClient
+
+# (city, state, lat, long) of the dataset's larger metros
+CITY_CENTERS = [
+    ("Philadelphia", "PA", 39.9526, -75.1652),
+    ("Tampa", "FL", 27.9506, -82.4572),
+    ("Indianapolis", "IN", 39.7684, -86.1581),
+    ("Nashville", "TN", 36.1627, -86.7816),
+    ("Tucson", "AZ", 32.2226, -110.9747),
+    ("New Orleans", "LA", 29.9511, -90.0715),
+    ("Reno", "NV", 39.5296, -119.8138),
+    ("Santa Barbara", "CA", 34.4208, -119.6982),
+]
+CATEGORIES = ["Pizza", "Sushi Bars", "Mexican", "Coffee & Tea", "Burgers", "Thai", "Bakeries",
+              "Steakhouses", "Vegan", "Breakfast & Brunch", "Seafood", "Ramen", "Bars", "Italian"]
+WORDS = ["great", "terrible", "friendly", "slow", "fresh", "crispy", "spicy", "cozy", "loud", "cheap",
+         "pricey", "delicious", "bland", "service", "staff", "portion", "wait", "atmosphere", "dessert",
+         "patio", "brunch", "cocktails", "noodles", "tacos", "crust", "latte", "steak", "oysters"]
+# Default share of each route in the workload
+DEFAULT_MIX = "location=30,semantic=15,reviews=40,details=10,add_review=5"
+# Degrees of latitude/longitude around a city center (~5 km)
+CLUSTER_SPREAD = 0.05
+
+
+class Zipf:
+    """Samples indexes 0..n-1 with P(k) proportional to 1 / (k + 1) ** s."""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1.0 / (k + 1) ** s for k in range(n)))
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def clustered_point(rng, centers):
+    _, _, lat, long = rng.choice(centers)
+    return lat + rng.gauss(0, CLUSTER_SPREAD), long + rng.gauss(0, CLUSTER_SPREAD)
+
+
+def make_id(rng):
+    return "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_") for _ in range(22))
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    client = MongoClient(args.uri)
+    users_client = MongoClient(args.users_uri or args.uri)
+    db = client.yelp_data
+    users_db = users_client.yelp_data
+    try:
+        if args.drop:
+            db.businesses.drop()
+            db.reviews.drop()
+            users_db.users.drop()
+        elif db.businesses.estimated_document_count():
+            print("yelp_data.businesses is not empty; pass --drop to replace it.")
+            sys.exit(1)
+
+        businesses = []
+        for i in range(args.businesses):
+            city, state, _, _ = center = rng.choice(CITY_CENTERS)
+            lat, long = clustered_point(rng, [center])
+            businesses.append({
+                "business_id": make_id(rng),
+                "name": f"Bench {rng.choice(CATEGORIES)} {i}",
+                "address": f"{rng.randint(1, 9999)} Main St",
+                "city": city,
+                "state": state,
+                "postal_code": f"{rng.randint(10000, 99999)}",
+                "latitude": lat,
+                "longitude": long,
+                "location": {"type": "Point", "coordinates": [long, lat]},
+                "stars": 0.0,
+                "review_count": 0,
+                "is_open": 1,
+                "categories": ", ".join(rng.sample(CATEGORIES, 2)),
+            })
+        users = [{"user_id": make_id(rng), "name": f"Bench User {i}"} for i in range(args.users)]
+
+        # Businesses are generated in random order, so list position is the popularity rank
+        business_rank = Zipf(len(businesses), args.zipf, rng)
+        user_rank = Zipf(len(users), args.zipf, rng)
+        start_date = datetime(2015, 1, 1)
+        totals = {}
+        batch = []
+        for i in range(args.reviews):
+            business = businesses[business_rank.sample()]
+            stars = float(rng.randint(1, 5))
+            count, total = totals.get(business["business_id"], (0, 0.0))
+            totals[business["business_id"]] = (count + 1, total + stars)
+            batch.append({
+                "review_id": make_id(rng),
+                "business_id": business["business_id"],
+                "user_id": users[user_rank.sample()]["user_id"],
+                "stars": stars,
+                "text": f"{business['categories'].split(', ')[0]} " + " ".join(rng.choices(WORDS, k=rng.randint(5, 30))),
+                "date": start_date + timedelta(seconds=rng.randint(0, 9 * 365 * 86400)),
+                "state": business["state"],
+                "location": business["location"],
+            })
+            if len(batch) >= 10000:
+                db.reviews.insert_many(batch, ordered=False)
+                batch = []
+                print(f"Inserted {i + 1}/{args.reviews} reviews...", end='\r')
+        if batch:
+            db.reviews.insert_many(batch, ordered=False)
+
+        for business in businesses:
+            count, total = totals.get(business["business_id"], (0, 0.0))
+            business["review_count"] = count
+            business["stars"] = round(total / count * 2) / 2 if count else 0.0
+        db.businesses.insert_many(businesses, ordered=False)
+        users_db.users.insert_many(users, ordered=False)
+
+        db.businesses.create_index([("location", GEOSPHERE)])
+        db.businesses.create_index([("business_id", ASCENDING)])
+        db.reviews.create_index([("business_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+                                name="business_id_date_id")
+        users_db.users.create_index([("user_id", ASCENDING)])
+        print(f"\nSeeded {len(businesses)} businesses, {args.reviews} reviews, {len(users)} users "
+              f"(seed {args.seed}).")
+    finally:
+        client.close()
+        users_client.close()
+
+
+def load_businesses(uri, limit=10000):
+    """A deterministic set of businesses (by business_id) to draw requests from."""
+    client = MongoClient(uri)
+    try:
+        businesses = list(client.yelp_data.businesses.find(
+            {"location": {"$exists": True}}, {"_id": 0, "business_id": 1, "location": 1}
+        ).sort("business_id", ASCENDING).limit(limit))
+    finally:
+        client.close()
+    if not businesses:
+        raise SystemExit("No businesses found; run `seed` first.")
+    return businesses
+
+
+class Workload:
+    """Request generator: Zipfian businesses, points clustered around real businesses."""
+
+    def __init__(self, businesses, rng, zipf_s, clusters):
+        # Popularity rank and hot spots are the same for every connection,
+        # independent of business_id order
+        shared = random.Random(0)
+        sample = list(businesses)
+        shared.shuffle(sample)
+        self.rng = rng
+        self.business_ids = [b["business_id"] for b in sample]
+        self.ranks = Zipf(len(sample), zipf_s, rng)
+        self.centers = [
+            (None, None, b["location"]["coordinates"][1], b["location"]["coordinates"][0])
+            for b in shared.sample(sample, min(clusters, len(sample)))
+        ]
+        self.words = Zipf(len(WORDS), zipf_s, rng)
+
+    def business_id(self):
+        return self.business_ids[self.ranks.sample()]
+
+    def request(self, route):
+        """(method, path, body) for one request to `route`."""
+        if route == "location":
+            lat, long = clustered_point(self.rng, self.centers)
+            return "GET", f"/search/location?lat={lat:.6f}&long={long:.6f}&radius_meters={self.rng.choice([1000, 5000, 10000])}", None
+        if route == "semantic":
+            lat, long = clustered_point(self.rng, self.centers)
+            query = " ".join(WORDS[self.words.sample()] for _ in range(self.rng.randint(1, 3)))
+            return "GET", (f"/search/semantic?query={urllib.parse.quote(query)}&lat={lat:.6f}&long={long:.6f}"
+                           f"&radius_meters=5000"), None
+        if route == "reviews":
+            return "GET", f"/business/{self.business_id()}/reviews", None
+        if route == "details":
+            return "GET", f"/business/{self.business_id()}", None
+        if route == "add_review":
+            return "POST", "/add_review", orjson.dumps({
+                "business_id": self.business_id(),
+                "user_id": "loadtest-user",
+                "stars": float(self.rng.randint(1, 5)),
+                "text": " ".join(self.rng.choices(WORDS, k=12)),
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        raise ValueError(route)
+
+
+def parse_mix(mix):
+    routes, weights = [], []
+    for part in mix.split(","):
+        route, _, weight = part.partition("=")
+        routes.append(route.strip())
+        weights.append(float(weight))
+    return routes, list(itertools.accumulate(weights))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def worker(url, workload, routes, cumulative, deadline, warmup_until, results, lock):
+    parsed = urllib.parse.urlparse(url)
+    rng = workload.rng
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+    local = []
+    while time.monotonic() < deadline:
+        route = routes[bisect.bisect_left(cumulative, rng.random() * cumulative[-1])]
+        method, path, body = workload.request(route)
+        headers = {"Content-Type": "application/json"} if body else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+            ok = False
+        latency = (time.perf_counter() - start) * 1000
+        if time.monotonic() >= warmup_until:
+            local.append((route, latency, ok))
+    conn.close()
+    with lock:
+        results.extend(local)
+
+
+def spawn_server(args):
+    env = dict(
+        os.environ,
+        MONGO_URI=args.uri,
+        MONGO_USERS_URI=args.users_uri or args.uri,
+        EMBEDDING_BACKEND="fake",
+        VECTOR_STORE="fake",
+        # A standalone mongod has no change streams
+        RESPONSE_CACHE_WATCH="0",
+    )
+    port = urllib.parse.urlparse(args.url).port or 8000
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+    for _ in range(120):
+        try:
+            conn = http.client.HTTPConnection("localhost", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        if server.poll() is not None:
+            raise SystemExit("API server exited during startup.")
+        time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("API server did not start.")
+
+
+def run(args):
+    routes, cumulative = parse_mix(args.mix)
+    businesses = load_businesses(args.uri)
+    # Same seed, same request sequence per connection
+    workloads = [
+        Workload(businesses, random.Random(args.seed + i), args.zipf, args.clusters)
+        for i in range(args.concurrency)
+    ]
+    server = spawn_server(args) if args.spawn else None
+    try:
+        results = []
+        lock = threading.Lock()
+        start = time.monotonic()
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.duration
+        print(f"Running {args.mix} with {args.concurrency} connections for {args.duration}s "
+              f"(+{args.warmup}s warmup) against {args.url}...")
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(worker, args.url, workload, routes, cumulative, deadline, warmup_until, results, lock)
+                for workload in workloads
+            ]
+        # A worker that raised has dropped its results; say so instead of under-reporting
+        failed = 0
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Worker failed: {e!r}")
+        if failed:
+            print(f"{failed} of {len(futures)} workers failed; their requests are missing from the report.")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {"duration_s": args.duration, "concurrency": args.concurrency, "mix": args.mix, "routes": {}}
+    print(f"{'route':>11} | {'requests':>8} | {'errors':>6} | {'req/s':>8} | {'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7}")
+    for route in routes + ["all"]:
+        latencies = sorted(l for r, l, ok in results if (route == "all" or r == route) and ok)
+        errors = sum(1 for r, _, ok in results if (route == "all" or r == route) and not ok)
+        stats = {
+            "requests": len(latencies) + errors,
+            "errors": errors,
+            "rps": len(latencies) / args.duration,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+        report["routes"][route] = stats
+        print(f"{route:>11} | {stats['requests']:>8} | {errors:>6} | {stats['rps']:>8.1f} | "
+              f"{stats['p50_ms']:>7.1f} | {stats['p95_ms']:>7.1f} | {stats['p99_ms']:>7.1f}")
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        print(f"Wrote {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = sub.add_parser("seed", help="Load synthetic data into a local mongod")
+    seed_parser.add_argument("--businesses", type=int, default=5000)
+    seed_parser.add_argument("--reviews", type=int, default=200000)
+    seed_parser.add_argument("--users", type=int, default=20000)
+    seed_parser.add_argument("--drop", action="store_true", help="Replace existing yelp_data collections")
+
+    run_parser = sub.add_parser("run", help="Drive the API with a mixed workload")
+    run_parser.add_argument("--url", default="http://localhost:8000")
+    run_parser.add_argument("--spawn", action="store_true", help="Start the API with local stand-ins")
+    run_parser.add_argument("--duration", type=int, default=30)
+    run_parser.add_argument("--warmup", type=int, default=5)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--mix", default=DEFAULT_MIX)
+    run_parser.add_argument("--clusters", type=int, default=8, help="Hot spots for geo queries")
+    run_parser.add_argument("--json", help="Write the report to this file")
+
+    for p in (seed_parser, run_parser):
+        p.add_argument("--uri", default="mongodb://localhost:27017")
+        p.add_argument("--users-uri", default=None, help="Users database (defaults to --uri)")
+        p.add_argument("--seed", type=int, default=42)
+        p.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for popularity")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Recall vs. latency vs. memory of Review vector index settings on a local sample.
+Copies --sample review vectors from the live collection into one scratch
+collection per compression setting, then queries held-out review vectors at
+several ef values and compares against exact (brute-force cosine) neighbours.
+Needs a local Weaviate with indexed reviews (docker-compose.yml).
+
+    python -m benchmarks.review_index_bench --sample 50000 --queries 200
+    python -m benchmarks.review_index_bench --metrics-url http://localhost:2112/metrics
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+
+import numpy as np
+from weaviate.classes.config import Reconfigure
+from weaviate.classes.data import DataObject
+
+from services.review_schema import (
+    REVIEW_COLLECTION, HNSW_MAX_CONNECTIONS, PQ_SEGMENTS, create_review_collection
+)
+from services.weaviate_pool import connect
+
+COMPRESSIONS = ["none", "pq", "bq"]
+EF_VALUES = [64, 128, 256, 512]
+BATCH_SIZE = 500
+
+
+def load_sample(reviews, sample, queries):
+    """(objects to index, their vectors, query vectors) from the live collection."""
+    objects = []
+    for obj in reviews.iterator(include_vector=True, return_properties=["review_id", "business_id"]):
+        objects.append(obj)
+        if len(objects) >= sample + queries:
+            break
+    vectors = np.array([obj.vector["default"] for obj in objects], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return objects[queries:], vectors[queries:], vectors[:queries]
+
+
+def exact_neighbours(vectors, query_vectors, k):
+    # Cosine on normalized vectors; indices of the top k per query
+    scores = query_vectors @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def estimated_memory_mb(n, dims, compression, max_connections=HNSW_MAX_CONNECTIONS):
+    """
+    In-memory vectors plus the HNSW graph (layer 0 holds 2 * maxConnections
+    links of ~10 bytes). Compressed indexes keep full vectors on disk only.
+    """
+    if compression == "pq":
+        vector_bytes = n * PQ_SEGMENTS
+    elif compression == "bq":
+        vector_bytes = n * dims / 8
+    else:
+        vector_bytes = n * dims * 4
+    graph_bytes = n * 2 * max_connections * 10
+    return (vector_bytes + graph_bytes) / 1e6
+
+
+def heap_mb(metrics_url):
+    """Weaviate's Go heap in use, from its Prometheus endpoint (PROMETHEUS_MONITORING_ENABLED)."""
+    if not metrics_url:
+        return None
+    with urllib.request.urlopen(metrics_url) as response:
+        for line in response.read().decode().splitlines():
+            if line.startswith("go_memstats_heap_inuse_bytes "):
+                return float(line.split()[1]) / 1e6
+    return None
+
+
+def build(w_client, name, compression, objects, vectors):
+    if w_client.collections.exists(name):
+        w_client.collections.delete(name)
+    # PQ is enabled after loading so the codebook trains on the whole sample
+    collection = create_review_collection(w_client, name, compression=compression)
+    start = time.perf_counter()
+    for i in range(0, len(objects), BATCH_SIZE):
+        batch = [
+            DataObject(uuid=obj.uuid, properties=obj.properties, vector=vector.tolist())
+            for obj, vector in zip(objects[i:i + BATCH_SIZE], vectors[i:i + BATCH_SIZE])
+        ]
+        result = collection.data.insert_many(batch)
+        if result.errors:
+            raise RuntimeError(f"{len(result.errors)} objects failed to insert into '{name}'")
+    if compression == "pq":
+        collection.config.update(vector_index_config=Reconfigure.VectorIndex.hnsw(
+            quantizer=Reconfigure.VectorIndex.Quantizer.pq(
+                enabled=True, segments=PQ_SEGMENTS, training_limit=len(objects)
+            )
+        ))
+    return collection, time.perf_counter() - start
+
+
+def measure(collection, query_vectors, truth, uuid_index, k):
+    timings = []
+    found = 0
+    for query_vector, expected in zip(query_vectors, truth):
+        start = time.perf_counter()
+        response = collection.query.near_vector(near_vector=query_vector.tolist(), limit=k, return_properties=[])
+        timings.append((time.perf_counter() - start) * 1000)
+        hits = {uuid_index.get(str(obj.uuid)) for obj in response.objects}
+        found += len(hits & set(expected.tolist()))
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return found / (len(truth) * k), statistics.median(timings), p95
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--compression", nargs="+", default=COMPRESSIONS, choices=COMPRESSIONS)
+    parser.add_argument("--metrics-url", default=None)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch collections")
+    args = parser.parse_args()
+
+    w_client = connect()
+    scratch = []
+    try:
+        print(f"Sampling {args.sample} + {args.queries} vectors from '{REVIEW_COLLECTION}'...")
+        objects, vectors, query_vectors = load_sample(
+            w_client.collections.get(REVIEW_COLLECTION), args.sample, args.queries
+        )
+        truth = exact_neighbours(vectors, query_vectors, args.k)
+        uuid_index = {str(obj.uuid): i for i, obj in enumerate(objects)}
+        dims = vectors.shape[1]
+
+        print(f"{'index':>6} | {'ef':>4} | {f'recall@{args.k}':>9} | {'p50/p95 ms':>15} | "
+              f"{'est MB':>7} | {'heap MB':>7} | load s")
+        for compression in args.compression:
+            name = f"ReviewBench_{compression}"
+            scratch.append(name)
+            before = heap_mb(args.metrics_url)
+            collection, load_s = build(w_client, name, compression, objects, vectors)
+            after = heap_mb(args.metrics_url)
+            heap = f"{after - before:7.0f}" if before is not None and after is not None else f"{'-':>7}"
+            for ef in EF_VALUES:
+                collection.config.update(vector_index_config=Reconfigure.VectorIndex.hnsw(ef=ef))
+                recall, p50, p95 = measure(collection, query_vectors, truth, uuid_index, args.k)
+                print(f"{compression:>6} | {ef:>4} | {recall:>9.3f} | {p50:>6.1f} / {p95:>6.1f} | "
+                      f"{estimated_memory_mb(len(objects), dims, compression):>7.0f} | {heap} | {load_s:.0f}")
+    finally:
+        if not args.keep:
+            for name in scratch:
+                w_client.collections.delete(name)
+        w_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Latency of the semantic-search filter step across radius sizes:
+  business_ids: $near in MongoDB, then near_vector with containsAny(business_ids)
+  weaviate:     near_vector with a withinGeoRange filter on Review.location
+Needs MongoDB, Weaviate (reviews indexed with locations) and the embedding backend.
+
+    python -m benchmarks.semantic_geo_filter_bench --query pizza --runs 20
+"""
+import argparse
+import statistics
+import time
+
+from pymongo import MongoClient
+from weaviate.classes.query import Filter
+from weaviate.classes.data import GeoCoordinate
+
+from services.embeddings import get_provider
+from services.review_schema import REVIEW_COLLECTION
+from services.weaviate_pool import connect
+
+RADII_M = [500, 1000, 2000, 5000, 10000, 25000, 50000]
+
+
+def by_business_ids(db, reviews, vector, lat, long, radius):
+    nearby = list(db.businesses.find({
+        "location": {
+            "$near": {
+                "$geometry": {"type": "Point", "coordinates": [long, lat]},
+                "$maxDistance": radius
+            }
+        }
+    }, {"business_id": 1}))
+    if not nearby:
+        return 0, 0
+    ids = [b["business_id"] for b in nearby]
+    response = reviews.query.near_vector(
+        near_vector=vector,
+        limit=20,
+        filters=Filter.by_property("business_id").contains_any(ids),
+        return_metadata=["distance"]
+    )
+    return len(ids), len(response.objects)
+
+
+def by_geo_filter(db, reviews, vector, lat, long, radius):
+    response = reviews.query.near_vector(
+        near_vector=vector,
+        limit=20,
+        filters=Filter.by_property("location").within_geo_range(
+            coordinate=GeoCoordinate(latitude=lat, longitude=long),
+            distance=radius
+        ),
+        return_metadata=["distance"]
+    )
+    return 0, len(response.objects)
+
+
+def measure(fn, runs, *args):
+    timings = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return statistics.median(timings), p95, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--query", default="pizza")
+    parser.add_argument("--lat", type=float, default=34.426679)
+    parser.add_argument("--long", type=float, default=-119.711197)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    mongo_client = MongoClient("mongodb://localhost:27017")
+    db = mongo_client.yelp_data
+    w_client = connect()
+    try:
+        reviews = w_client.collections.get(REVIEW_COLLECTION)
+        vector = get_provider().embed([args.query])[0]
+
+        print(f"{'radius_m':>9} | {'ids':>6} | {'business_ids p50/p95 ms':>24} | {'weaviate geo p50/p95 ms':>24} | hits")
+        for radius in RADII_M:
+            p50_a, p95_a, (ids, hits_a) = measure(by_business_ids, args.runs, db, reviews, vector, args.lat, args.long, radius)
+            p50_b, p95_b, (_, hits_b) = measure(by_geo_filter, args.runs, db, reviews, vector, args.lat, args.long, radius)
+            print(f"{radius:>9} | {ids:>6} | {p50_a:>11.1f} / {p95_a:>10.1f} | {p50_b:>11.1f} / {p95_b:>10.1f} | {hits_a}/{hits_b}")
+    finally:
+        w_client.close()
+        mongo_client.close()
+
+
+if __name__ == "__main__":
+    main()
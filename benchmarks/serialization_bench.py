@@ -0,0 +1,83 @@
+"""
+CPU per response for the discovery routes: the old json_util round trip
+(dumps -> json.loads -> FastAPI's jsonable_encoder + json.dumps) against
+BSONResponse with the trimmed projections. Uses synthetic Yelp-shaped
+documents, so it needs no database.
+
+    python -m benchmarks.serialization_bench --iterations 2000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+from bson import ObjectId, json_util
+from fastapi.encoders import jsonable_encoder
+
+from responses import BSONResponse
+from queries import LOCATION_SEARCH_PROJECTION, BUSINESS_DETAILS_PROJECTION
+
+
+def business(i):
+    return {
+        "_id": ObjectId(),
+        "business_id": f"biz-{i:06d}",
+        "name": f"Business {i}",
+        "address": f"{i} Main St",
+        "city": "Santa Barbara",
+        "state": "CA",
+        "postal_code": "93101",
+        "latitude": 34.42 + random.random() / 100,
+        "longitude": -119.70 + random.random() / 100,
+        "location": {"type": "Point", "coordinates": [-119.70, 34.42]},
+        "stars": 4.5,
+        "review_count": random.randint(5, 5000),
+        "is_open": 1,
+        "attributes": {f"Attribute{k}": "u'free'" for k in range(30)},
+        "categories": "Restaurants, Pizza, Italian",
+        "hours": {day: "11:0-22:0" for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]},
+        "last_updated": datetime(2024, 1, 1, 12, 0, 0),
+    }
+
+
+def project(doc, projection):
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+def old_path(data):
+    parsed = json.loads(json_util.dumps(data))
+    return json.dumps(jsonable_encoder(parsed)).encode()
+
+
+def new_path(data):
+    return BSONResponse(data).body
+
+
+def cpu_per_call(fn, data, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(data)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    search = [business(i) for i in range(20)]
+    details = business(0)
+    cases = [
+        ("/search/location (20 docs)", search, [project(d, LOCATION_SEARCH_PROJECTION) for d in search]),
+        ("/business/{id}", details, project(details, BUSINESS_DETAILS_PROJECTION)),
+    ]
+    for label, full, trimmed in cases:
+        before = cpu_per_call(old_path, full, args.iterations)
+        after = cpu_per_call(new_path, trimmed, args.iterations)
+        print(f"{label:<28} json_util round trip {before:8.1f} us   orjson {after:8.1f} us   "
+              f"saved {before - after:8.1f} us/request ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
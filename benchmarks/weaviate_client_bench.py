@@ -0,0 +1,62 @@
+"""
+Requests/sec of a Weaviate query with connect-per-request vs. the shared
+AsyncWeaviatePool used by routes/semantic.py.
+Needs a local Weaviate with the 'Review' collection (docker-compose.yml).
+
+    python -m benchmarks.weaviate_client_bench --requests 500 --concurrency 16
+"""
+import argparse
+import asyncio
+import time
+
+from services.review_schema import REVIEW_COLLECTION
+from services.weaviate_pool import AsyncWeaviatePool, connect_async
+
+
+async def query(client):
+    await client.collections.get(REVIEW_COLLECTION).query.fetch_objects(limit=1)
+
+
+async def per_request():
+    # Old behaviour of routes/semantic.py
+    client = connect_async()
+    await client.connect()
+    try:
+        await query(client)
+    finally:
+        await client.close()
+
+
+async def run(label, fn, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await fn()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<20} {requests / elapsed:8.1f} req/s  ({elapsed:.2f}s for {requests} requests)")
+
+
+async def main(args):
+    await run("connect-per-request", per_request, args.requests, args.concurrency)
+
+    pool = AsyncWeaviatePool(size=args.pool_size, acquire_timeout=60.0)
+    await pool.open()
+    try:
+        async def pooled():
+            async with pool.client() as client:
+                await query(client)
+        await run(f"pooled (size={args.pool_size})", pooled, args.requests, args.concurrency)
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pool-size", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
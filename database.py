@@ -1,22 +1,46 @@
-from pymongo import MongoClient, ReadPreference, WriteConcern
+import os
+from pymongo import AsyncMongoClient, ReadPreference, WriteConcern
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+from services.metrics import mongo_command_metrics
 
 # Connect to the MONGOS router, not a specific shard
-MONGO_URI = "mongodb://localhost:27017" 
+# (or a single local mongod for benchmarks, see benchmarks/loadtest.py)
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 
-client = MongoClient(MONGO_URI)
+# Command latency / documents returned per collection, exported on /metrics
+event_listeners = [mongo_command_metrics]
 
 # Database Configuration per Report Section 2.3
-db = client.get_database("yelp_data")
-
 # Writes: "majority" for durability
 write_concern = WriteConcern(w="majority", j=True)
-db_write = db.with_options(write_concern=write_concern)
 
-# Reads: "secondaryPreferred" for read scaling
-read_preference = ReadPreference.SECONDARY_PREFERRED
-db_read = db.with_options(read_preference=read_preference)
+# Reads: "secondaryPreferred" for read scaling, skipping secondaries that lag
+# the primary by more than MAX_STALENESS_SECONDS (MongoDB's minimum is 90; -1 disables)
+MAX_STALENESS_SECONDS = int(os.environ.get("MAX_STALENESS_SECONDS", "90"))
+read_preference = SecondaryPreferred(max_staleness=MAX_STALENESS_SECONDS)
 
 # Users Service Connection (Port 27018)
-MONGO_USERS_URI = "mongodb://localhost:27018"
-client_users = MongoClient(MONGO_USERS_URI)
-db_users = client_users.get_database("yelp_data")
+MONGO_USERS_URI = os.environ.get("MONGO_USERS_URI", "mongodb://localhost:27018")
+
+# Clients for the request path (routes/*); scripts open their own MongoClient
+async_client = AsyncMongoClient(MONGO_URI, event_listeners=event_listeners)
+async_db = async_client.get_database("yelp_data")
+async_db_write = async_db.with_options(write_concern=write_concern)
+async_db_read = async_db.with_options(read_preference=read_preference)
+# Read-your-own-writes (services/causal.py): majority reads in a causally
+# consistent session, on a secondary or, if none catches up in time, the primary
+async_db_causal_read = async_db.with_options(read_preference=read_preference,
+                                             read_concern=ReadConcern("majority"))
+async_db_primary_read = async_db.with_options(read_preference=ReadPreference.PRIMARY,
+                                              read_concern=ReadConcern("majority"))
+
+async_client_users = AsyncMongoClient(MONGO_USERS_URI, event_listeners=event_listeners)
+async_db_users = async_client_users.get_database("yelp_data")
+
+async def ensure_indexes():
+    # Keyset pagination of a business's reviews, newest first (routes/discovery.py)
+    await async_db_write.reviews.create_index(
+        [("business_id", 1), ("date", -1), ("_id", -1)],
+        name="business_id_date_id"
+    )
@@ -0,0 +1,102 @@
+from weaviate.classes.data import DataObject
+from weaviate.classes.query import Filter
+from pymongo import MongoClient
+import sys
+import time
+from services.review_schema import REVIEW_COLLECTION, ensure_review_collection, review_uuid
+from services.weaviate_pool import connect
+
+CHUNK_SIZE = 500
+
+def flush(w_reviews, rekeyed, legacy_ids):
+    # Upsert under the deterministic ID first, then drop the random-ID copies,
+    # so an interrupted run never loses a review
+    if rekeyed:
+        result = w_reviews.data.insert_many(rekeyed)
+        if result.errors:
+            raise RuntimeError(f"{len(result.errors)} re-keyed objects failed to insert")
+    if legacy_ids:
+        w_reviews.data.delete_many(where=Filter.by_id().contains_any(legacy_ids))
+
+def dedupe_reviews(dry_run=False):
+    """
+    Re-key Review objects written with random UUIDs onto review_uuid(review_id)
+    and delete the originals. Duplicates of one review collapse onto the same
+    deterministic ID, so they are removed in the same pass.
+    """
+    print("Connecting to MongoDB...")
+    mongo_client = MongoClient("mongodb://localhost:27017")
+    db = mongo_client.yelp_data
+
+    print("Connecting to Weaviate...")
+    w_client = connect()
+
+    try:
+        w_reviews = ensure_review_collection(w_client)
+        before = w_reviews.aggregate.over_all(total_count=True).total_count
+        print(f"Weaviate '{REVIEW_COLLECTION}' objects before: {before}")
+
+        scanned = 0
+        canonical = 0
+        legacy = 0
+        seen = set()
+        duplicates = 0
+        rekeyed = []
+        legacy_ids = []
+        start_time = time.time()
+
+        for obj in w_reviews.iterator(include_vector=not dry_run):
+            scanned += 1
+            review_id = obj.properties.get("review_id")
+            if review_id is None:
+                continue
+            if dry_run:
+                # Hash keeps the set small enough for millions of reviews
+                key = hash(review_id)
+                if key in seen:
+                    duplicates += 1
+                seen.add(key)
+
+            expected = review_uuid(review_id)
+            if str(obj.uuid) == expected:
+                canonical += 1
+                continue
+            legacy += 1
+            if dry_run:
+                continue
+
+            rekeyed.append(DataObject(
+                uuid=expected,
+                properties=obj.properties,
+                vector=obj.vector["default"]
+            ))
+            legacy_ids.append(obj.uuid)
+            if len(legacy_ids) >= CHUNK_SIZE:
+                flush(w_reviews, rekeyed, legacy_ids)
+                rekeyed = []
+                legacy_ids = []
+
+            if scanned % 10000 == 0:
+                rate = scanned / (time.time() - start_time)
+                print(f"Scanned {scanned} ({rate:.0f}/s), re-keyed {legacy}...", end='\r')
+
+        if not dry_run:
+            flush(w_reviews, rekeyed, legacy_ids)
+
+        print(f"\nScanned {scanned}: {canonical} with deterministic IDs, {legacy} with random IDs.")
+        if dry_run:
+            print(f"Duplicate review_ids: {duplicates} (dry run, nothing changed)")
+
+        # Verification
+        after = w_reviews.aggregate.over_all(total_count=True).total_count
+        expected_count = db.reviews.count_documents({"text": {"$nin": ["", None]}})
+        print(f"Weaviate '{REVIEW_COLLECTION}' objects after: {after} (removed {before - after})")
+        print(f"MongoDB reviews with text: {expected_count}")
+        if not dry_run and after != expected_count:
+            print(f"WARNING: {expected_count - after:+d} difference between MongoDB and Weaviate")
+    finally:
+        w_client.close()
+        mongo_client.close()
+
+if __name__ == "__main__":
+    dedupe_reviews(dry_run="--dry-run" in sys.argv)
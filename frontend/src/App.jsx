@@ -35,7 +35,8 @@ function App() {
             const data = await response.json();
 
             if (isSemantic) {
-                setSemanticResults(Array.isArray(data) ? data : []);
+                // Business-level hits, already grouped and ranked by the server
+                setSemanticResults(Array.isArray(data.results) ? data.results : []);
                 setBusinesses([]); // Clear businesses
             } else {
                 setBusinesses(Array.isArray(data) ? data : []);
@@ -1,19 +1,28 @@
 import React, { useState } from 'react';
 
+// Token from this tab's last write; reads that send it include that write.
+// Past the API's max staleness (90s) plus cache TTL (30s) any read includes it anyway.
+const CAUSAL_TOKEN_KEY = 'causalToken';
+const CAUSAL_TOKEN_TTL_MS = 120000;
+const causalHeaders = () => {
+    const saved = JSON.parse(sessionStorage.getItem(CAUSAL_TOKEN_KEY) || 'null');
+    return saved && Date.now() - saved.at < CAUSAL_TOKEN_TTL_MS ? { 'X-Causal-Token': saved.token } : {};
+};
 
 const ReviewList = ({ businessId, onBack }) => {
     const [reviews, setReviews] = useState([]);
     const [loading, setLoading] = useState(true);
     const [newReview, setNewReview] = useState({ stars: 5, text: '', user_id: 'user123' });
     const [business, setBusiness] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
 
     React.useEffect(() => {
         const fetchData = async () => {
             if (!businessId) return;
             try {
                 const [reviewsRes, businessRes] = await Promise.all([
-                    fetch(`http://localhost:8000/business/${businessId}/reviews`),
-                    fetch(`http://localhost:8000/business/${businessId}`)
+                    fetch(`http://localhost:8000/business/${businessId}/reviews`, { headers: causalHeaders() }),
+                    fetch(`http://localhost:8000/business/${businessId}`, { headers: causalHeaders() })
                 ]);
 
                 if (!reviewsRes.ok || !businessRes.ok) {
@@ -24,6 +33,7 @@ const ReviewList = ({ businessId, onBack }) => {
                 const businessData = await businessRes.json();
 
                 setReviews(Array.isArray(reviewsData) ? reviewsData : []);
+                setNextCursor(reviewsRes.headers.get('X-Next-Cursor'));
                 setBusiness(businessData);
             } catch (error) {
                 console.error("Error fetching data", error);
@@ -53,18 +63,33 @@ const ReviewList = ({ businessId, onBack }) => {
             });
 
             if (!response.ok) throw new Error("Failed to add review");
+            const token = response.headers.get('X-Causal-Token');
+            if (token) sessionStorage.setItem(CAUSAL_TOKEN_KEY, JSON.stringify({ token, at: Date.now() }));
 
             alert('Review added!');
             // Refresh reviews
-            const reviewsRes = await fetch(`http://localhost:8000/business/${businessId}/reviews`);
+            const reviewsRes = await fetch(`http://localhost:8000/business/${businessId}/reviews`, { headers: causalHeaders() });
             const reviewsData = await reviewsRes.json();
             setReviews(Array.isArray(reviewsData) ? reviewsData : []);
+            setNextCursor(reviewsRes.headers.get('X-Next-Cursor'));
             setNewReview({ ...newReview, text: '' });
         } catch (error) {
             alert('Error adding review: ' + error.message);
         }
     };
 
+    const loadMoreReviews = async () => {
+        try {
+            const reviewsRes = await fetch(`http://localhost:8000/business/${businessId}/reviews?cursor=${encodeURIComponent(nextCursor)}`, { headers: causalHeaders() });
+            if (!reviewsRes.ok) throw new Error("Failed to fetch reviews");
+            const reviewsData = await reviewsRes.json();
+            setReviews([...reviews, ...(Array.isArray(reviewsData) ? reviewsData : [])]);
+            setNextCursor(reviewsRes.headers.get('X-Next-Cursor'));
+        } catch (error) {
+            console.error("Error fetching more reviews", error);
+        }
+    };
+
     if (loading) return <p>Loading...</p>;
 
     return (
@@ -98,6 +123,9 @@ const ReviewList = ({ businessId, onBack }) => {
                             </div>
                         );
                     })}
+                    {nextCursor && (
+                        <button onClick={loadMoreReviews} className="load-more-button">Load more reviews</button>
+                    )}
                 </div>
 
                 <div className="add-review-form">
@@ -5,23 +5,8 @@ function SemanticResults({ results, onSelect }) {
         return <div className="no-results">No relevant businesses found.</div>;
     }
 
-    // Group by business_id to show unique businesses
-    const businessMap = new Map();
-
-    results.forEach(result => {
-        if (!businessMap.has(result.business_id)) {
-            businessMap.set(result.business_id, {
-                ...result,
-                matching_reviews: []
-            });
-        }
-        // Collect top matching snippets
-        if (businessMap.get(result.business_id).matching_reviews.length < 3) {
-            businessMap.get(result.business_id).matching_reviews.push(result.review_text);
-        }
-    });
-
-    const uniqueBusinesses = Array.from(businessMap.values());
+    // One entry per business, grouped and ranked by /search/semantic
+    const uniqueBusinesses = results;
 
     return (
         <div className="semantic-results">
@@ -44,7 +29,7 @@ function SemanticResults({ results, onSelect }) {
 
                         <div className="match-snippet">
                             <strong>Top Match:</strong>
-                            <p>"{business.matching_reviews[0]}"</p>
+                            <p>"{business.matching_reviews[0]?.text}"</p>
                         </div>
 
                         <small className="relevance">Relevance: {business.score?.toFixed(4)}</small>
@@ -0,0 +1,236 @@
+"""
+Load the Yelp academic dataset into the sharded cluster through mongos.
+
+    python load_yelp.py --data-dir ./yelp_dataset --workers 8
+    python load_yelp.py --skip-businesses --drop-reviews
+
+Streams the JSON-lines files in fixed-size batches of raw lines; worker
+processes parse them with orjson, enrich reviews from a compact
+business_id -> (state, lon, lat) lookup and insert with unordered
+insert_many. At most 2 * workers batches are in flight, so memory stays
+bounded regardless of file size. Batches that hit a transient error
+(failover, timeout) are retried with backoff; those still failing are
+reported and counted, and the load goes on.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import orjson
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+
+MONGO_URI = "mongodb://localhost:27017"
+DATABASE = "yelp_data"
+BUSINESS_FILE = "yelp_academic_dataset_business.json"
+REVIEW_FILE = "yelp_academic_dataset_review.json"
+REPORT_INTERVAL = 5
+# Retries of a batch after a network error, primary stepdown or timeout
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # seconds, doubled per retry
+RETRY_BACKOFF_MAX = 30.0
+DUPLICATE_KEY = 11000
+
+_collection = None
+_lookup = None
+
+
+def _init_worker(uri, db_name, coll_name, lookup):
+    # One client per worker process; MongoClient must not cross a fork
+    global _collection, _lookup
+    _collection = MongoClient(uri)[db_name][coll_name]
+    _lookup = lookup
+
+
+def business_document(business):
+    """Business with a GeoJSON 'location', or None if it has no position or state."""
+    lon, lat = business.get("longitude"), business.get("latitude")
+    if lon is None or lat is None or not business.get("state"):
+        return None
+    # IMPORTANT: Coordinates are [longitude, latitude]
+    business["location"] = {"type": "Point", "coordinates": [lon, lat]}
+    return business
+
+
+def review_document(review):
+    """Review enriched with its business's state and location, or None for unknown businesses."""
+    entry = _lookup.get(review.get("business_id"))
+    if entry is None:
+        return None
+    state, lon, lat = entry
+    review["state"] = state
+    review["location"] = {"type": "Point", "coordinates": [lon, lat]}
+    if isinstance(review.get("date"), str):
+        review["date"] = datetime.fromisoformat(review["date"])
+    return review
+
+
+def insert_lines(kind, lines):
+    """Worker process: parse, transform and insert one batch. Returns (inserted, skipped, failed)."""
+    transform = business_document if kind == "businesses" else review_document
+    docs = []
+    skipped = 0
+    for line in lines:
+        try:
+            doc = transform(orjson.loads(line))
+        except (orjson.JSONDecodeError, ValueError):
+            doc = None
+        if doc is None:
+            skipped += 1
+        else:
+            docs.append(doc)
+    if not docs:
+        return 0, skipped, 0
+    failed = insert_with_retries(docs)
+    return len(docs) - failed, skipped, failed
+
+
+def insert_with_retries(docs):
+    """Worker process: insert_many, retried on transient errors. Returns the number of docs not inserted."""
+    delay = RETRY_BACKOFF
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            _collection.insert_many(docs, ordered=False)
+            return 0
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if attempt:
+                # insert_many set each doc's _id on the first attempt, so a
+                # duplicate key now is a document that attempt already wrote
+                errors = [err for err in errors if err.get("code") != DUPLICATE_KEY]
+            return len(errors)
+        except PyMongoError as e:
+            if attempt == MAX_RETRIES:
+                # Part of the batch may have been written before the error
+                print(f"\nBatch of {len(docs)} failed after {MAX_RETRIES} retries "
+                      f"(first _id {docs[0].get('_id')}): {e}")
+                return len(docs)
+            print(f"\nBatch of {len(docs)} failed, retrying in {delay:.0f}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_BACKOFF_MAX)
+
+
+def read_batches(path, batch_size):
+    with open(path, "rb") as f:
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def build_business_lookup(path):
+    """business_id -> (state, lon, lat) for every business that reviews can be attached to."""
+    lookup = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            business = orjson.loads(line)
+            lon, lat, state = business.get("longitude"), business.get("latitude"), business.get("state")
+            if lon is not None and lat is not None and state:
+                lookup[business["business_id"]] = (state, lon, lat)
+    return lookup
+
+
+def load_file(args, kind, path, lookup=None):
+    size = os.path.getsize(path)
+    print(f"Loading {path} ({size / 1e9:.2f} GB) into {args.db}.{kind} with {args.workers} workers...")
+    inserted = skipped = failed = 0
+    bytes_read = 0
+    start_time = time.time()
+    last_report = start_time
+    in_flight = {}
+
+    def collect(done):
+        nonlocal inserted, skipped, failed
+        for future in done:
+            batch_size = in_flight.pop(future)
+            try:
+                batch_inserted, batch_skipped, batch_failed = future.result()
+            except Exception as e:
+                # e.g. a worker process died; count the whole batch and keep loading
+                print(f"\nBatch of {batch_size} lines failed: {e}")
+                batch_inserted, batch_skipped, batch_failed = 0, 0, batch_size
+            inserted += batch_inserted
+            skipped += batch_skipped
+            failed += batch_failed
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.uri, args.db, kind, lookup)) as executor:
+        for batch in read_batches(path, args.batch_size):
+            # Bounded: wait for a batch to finish before reading further
+            while len(in_flight) >= 2 * args.workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            bytes_read += sum(len(line) for line in batch)
+            in_flight[executor.submit(insert_lines, kind, batch)] = len(batch)
+
+            now = time.time()
+            if now - last_report >= REPORT_INTERVAL:
+                last_report = now
+                elapsed = now - start_time
+                print(f"{inserted} inserted, {skipped} skipped, {failed} failed | "
+                      f"{inserted / elapsed:.0f} docs/s, {bytes_read / elapsed / 1e6:.1f} MB/s, "
+                      f"{100 * bytes_read / size:.1f}% read", end='\r')
+        collect(wait(in_flight)[0])
+
+    elapsed = time.time() - start_time
+    print(f"\n{kind}: inserted {inserted}, skipped {skipped}, failed {failed} "
+          f"in {elapsed:.0f}s ({inserted / max(elapsed, 1e-9):.0f} docs/s).")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the Yelp dataset into MongoDB.")
+    parser.add_argument("--data-dir", default="./yelp_dataset")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=DATABASE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--skip-businesses", action="store_true")
+    parser.add_argument("--skip-reviews", action="store_true")
+    parser.add_argument("--drop-businesses", action="store_true", help="Delete existing businesses first")
+    parser.add_argument("--drop-reviews", action="store_true", help="Delete existing reviews first")
+    args = parser.parse_args()
+
+    business_path = os.path.join(args.data_dir, BUSINESS_FILE)
+    review_path = os.path.join(args.data_dir, REVIEW_FILE)
+
+    client = MongoClient(args.uri)
+    try:
+        client.admin.command("ping")
+        db = client[args.db]
+        # delete_many rather than drop, to keep the collections' sharding
+        if args.drop_businesses:
+            print(f"Cleared {db.businesses.delete_many({}).deleted_count} businesses.")
+        if args.drop_reviews:
+            print(f"Cleared {db.reviews.delete_many({}).deleted_count} reviews.")
+    except Exception as e:
+        print(f"Error connecting to MongoDB: {e}")
+        sys.exit(1)
+    finally:
+        client.close()
+
+    failed = 0
+    if not args.skip_businesses:
+        failed += load_file(args, "businesses", business_path)
+    if not args.skip_reviews:
+        print("Building business lookup...")
+        lookup = build_business_lookup(business_path)
+        print(f"Business lookup has {len(lookup)} entries.")
+        failed += load_file(args, "reviews", review_path, lookup)
+    if failed:
+        print(f"{failed} documents failed to insert.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
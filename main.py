@@ -1,8 +1,49 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from routes import transactions, discovery, semantic
+from services.weaviate_pool import async_weaviate_pool
+from database import async_client, async_client_users, async_db, ensure_indexes
+from services.embeddings import get_provider
+from services.response_cache import watch_invalidations
+from services.metrics import CONTENT_TYPE, ERRORS, HTTP_REQUEST_SECONDS, render
 
-app = FastAPI(title="Yelp Distributed App")
+# Watch the reviews/businesses change streams so writes through other API
+# workers also evict this worker's cached business responses
+RESPONSE_CACHE_WATCH = os.environ.get("RESPONSE_CACHE_WATCH", "1") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        ERRORS.inc("ensure_indexes")
+        print(f"Error ensuring indexes: {e}")
+    # Long-lived Weaviate clients shared by all requests
+    await async_weaviate_pool.open()
+    # Load the embedding backend (model weights for "local") before serving
+    get_provider()
+    # Flushes batched deltas, and retries failed inline updates
+    transactions.aggregate_buffer.start()
+    watcher = asyncio.create_task(watch_invalidations(async_db)) if RESPONSE_CACHE_WATCH else None
+    yield
+    if watcher is not None:
+        watcher.cancel()
+        try:
+            await watcher
+        except asyncio.CancelledError:
+            pass
+    # Apply any buffered rating deltas before shutting down
+    await transactions.aggregate_buffer.stop()
+    await async_weaviate_pool.close()
+    await async_client.close()
+    await async_client_users.close()
+
+app = FastAPI(title="Yelp Distributed App", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -11,13 +52,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Causal-Token"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template, not the raw path, to keep label cardinality bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, request.method,
+                                     route.path if route else "unmatched", str(status))
+
 # Include Routers
 app.include_router(transactions.router, tags=["Transactions"])
 app.include_router(discovery.router, tags=["Discovery"])
 app.include_router(semantic.router, tags=["Semantic Search"])
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text format; Mongo command, request stage and error metrics
+    return Response(render(), media_type=CONTENT_TYPE)
+
 @app.get("/")
 def root():
     return {"message": "Yelp Distributed System API is running"}
@@ -1,53 +1,333 @@
-from pymongo import MongoClient
+"""
+Copy collections between databases through mongos, in parallel _id ranges.
+
+    python migrate_data.py --workers 8 --ranges 64
+    python migrate_data.py --shard-key reviews=business_id:1,_id:1 --shard-key users=user_id:hashed
+    python migrate_data.py --verify-only
+
+Each collection is split into _id ranges (sampled split points), copied by a
+pool of worker processes and checkpointed per batch in the target database, so
+a rerun resumes where it stopped. Failed batches are retried; documents already
+present (duplicate _id from an earlier attempt) count as copied. A verification
+pass compares the document count and a hash of the raw BSON per range.
+"""
+import argparse
+import hashlib
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
 
 # Connect to MongoDB Router
 MONGO_URI = "mongodb://localhost:27017"
-client = MongoClient(MONGO_URI)
-
-source_db = client['test']
-target_db = client['yelp_data']
-
-def migrate_collection(coll_name):
-    source_coll = source_db[coll_name]
-    target_coll = target_db[coll_name]
-    
-    count = source_coll.count_documents({})
-    if count == 0:
-        print(f"No data in test.{coll_name}")
+SOURCE_DB = "test"
+TARGET_DB = "yelp_data"
+COLLECTIONS = ["businesses", "reviews", "users"]
+
+# Per-range progress, kept in the target database
+CHECKPOINT_COLLECTION = "migration_checkpoints"
+MAX_RETRIES = 5
+DUPLICATE_KEY = 11000
+RAW = CodecOptions(document_class=RawBSONDocument)
+
+_client = None
+
+
+def _init_worker(uri):
+    # One client per worker process; MongoClient must not cross a fork
+    global _client
+    _client = MongoClient(uri)
+
+
+def parse_shard_keys(specs):
+    """["reviews=business_id:1,_id:1", "users=user_id:hashed"] -> {"reviews": {...}, ...}"""
+    keys = {}
+    for spec in specs or []:
+        coll_name, _, fields = spec.partition("=")
+        key = {}
+        for field in fields.split(","):
+            name, _, kind = field.partition(":")
+            key[name] = "hashed" if kind == "hashed" else int(kind or 1)
+        keys[coll_name] = key
+    return keys
+
+
+def plan_ranges(source_coll, checkpoints, ranges):
+    """
+    Split a collection into `ranges` contiguous _id ranges using a random
+    sample for split points (no full scan), and persist them as checkpoints.
+    Returns (plan, created).
+    """
+    coll_name = source_coll.name
+    existing = list(checkpoints.find({"collection": coll_name}).sort("index", ASCENDING))
+    if existing:
+        return existing, False
+
+    sample = sorted({d["_id"] for d in source_coll.aggregate([
+        {"$sample": {"size": ranges * 50}},
+        {"$project": {"_id": 1}}
+    ])})
+    step = max(1, len(sample) // ranges)
+    bounds = [None] + sample[step::step][:ranges - 1] + [None]
+    plan = []
+    for i in range(len(bounds) - 1):
+        plan.append({
+            "_id": f"{coll_name}:{i}",
+            "collection": coll_name,
+            "index": i,
+            "lower": bounds[i],
+            "upper": bounds[i + 1],
+            "high_water": None,
+            "copied": 0,
+            "done": False,
+        })
+    checkpoints.insert_many(plan)
+    return plan, True
+
+
+def range_query(rng, resume=True):
+    id_range = {}
+    if resume and rng["high_water"] is not None:
+        id_range["$gt"] = rng["high_water"]
+    elif rng["lower"] is not None:
+        id_range["$gte"] = rng["lower"]
+    if rng["upper"] is not None:
+        id_range["$lt"] = rng["upper"]
+    return {"_id": id_range} if id_range else {}
+
+
+def presplit_target(client, source_coll, target_ns, shard_key, chunks):
+    """
+    Shard the empty target collection and, for a ranged key, split it at
+    sampled shard-key values and spread the chunks over all shards before
+    loading, so inserts go to every shard from the start instead of waiting
+    for the balancer. Hashed keys are pre-split by shardCollection itself.
+    """
+    admin = client.admin
+    db_name = target_ns.split(".", 1)[0]
+    try:
+        admin.command("enableSharding", db_name)
+    except OperationFailure:
+        # Not needed (or not supported) on newer servers
+        pass
+    try:
+        admin.command("shardCollection", target_ns, key=shard_key)
+        print(f"Sharded {target_ns} on {shard_key}.")
+    except OperationFailure as e:
+        print(f"Not sharding {target_ns}: {e}")
+        return
+    if "hashed" in shard_key.values():
         return
 
-    print(f"Migrating {count} documents from test.{coll_name} to yelp_data.{coll_name}...")
-    
-    # Batch insert
-    batch_size = 1000
+    fields = list(shard_key)
+    sample = source_coll.aggregate([
+        {"$sample": {"size": chunks * 20}},
+        {"$project": {"_id": 0, **{f: 1 for f in fields}}}
+    ])
+    points = sorted({tuple(d.get(f) for f in fields) for d in sample
+                     if all(d.get(f) is not None for f in fields)})
+    step = max(1, len(points) // chunks)
+    middles = [dict(zip(fields, p)) for p in points[step::step][:chunks - 1]]
+    shards = [s["_id"] for s in admin.command("listShards")["shards"]]
+    for i, middle in enumerate(middles):
+        try:
+            admin.command("split", target_ns, middle=middle)
+            # The chunk starting at `middle`; round-robin over the shards
+            admin.command("moveChunk", target_ns, find=middle, to=shards[(i + 1) % len(shards)])
+        except OperationFailure as e:
+            print(f"Error pre-splitting {target_ns} at {middle}: {e}")
+    print(f"Pre-split {target_ns} into {len(middles) + 1} chunks over {len(shards)} shards.")
+
+
+def insert_with_retry(target_coll, docs):
+    """Insert a batch, retrying failures; duplicates from an earlier attempt count as copied."""
+    pending = docs
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            target_coll.insert_many(pending, ordered=False)
+            return
+        except BulkWriteError as e:
+            failed = [err for err in e.details.get("writeErrors", []) if err["code"] != DUPLICATE_KEY]
+            if not failed:
+                return
+            pending = [pending[err["index"]] for err in failed]
+            error = failed[0]["errmsg"]
+        except AutoReconnect as e:
+            # Unknown outcome: resend the whole batch, duplicates are skipped
+            error = str(e)
+        if attempt < MAX_RETRIES:
+            time.sleep(min(30, 0.5 * 2 ** attempt))
+    raise RuntimeError(f"{len(pending)} documents failed after {MAX_RETRIES} retries: {error}")
+
+
+def copy_range(source_db, target_db, rng, batch_size):
+    """Worker process: copy one _id range, checkpointing after every batch."""
+    source_coll = _client[source_db].get_collection(rng["collection"], codec_options=RAW)
+    target_coll = _client[target_db].get_collection(rng["collection"], codec_options=RAW)
+    checkpoints = _client[target_db][CHECKPOINT_COLLECTION]
+
+    copied = 0
     batch = []
-    processed = 0
-    
-    cursor = source_coll.find({})
+    cursor = source_coll.find(range_query(rng)).sort("_id", ASCENDING).batch_size(batch_size)
     for doc in cursor:
         batch.append(doc)
         if len(batch) >= batch_size:
-            try:
-                target_coll.insert_many(batch, ordered=False)
-            except Exception as e:
-                print(f"Error inserting batch: {e}")
-            processed += len(batch)
-            print(f"Processed {processed}/{count}", end='\r')
+            copied += _flush(target_coll, checkpoints, rng, batch)
             batch = []
-            
     if batch:
+        copied += _flush(target_coll, checkpoints, rng, batch)
+    checkpoints.update_one({"_id": rng["_id"]}, {"$set": {"done": True}})
+    return copied
+
+
+def _flush(target_coll, checkpoints, rng, batch):
+    insert_with_retry(target_coll, batch)
+    # Only advance the high-water mark once the batch is in the target
+    checkpoints.update_one(
+        {"_id": rng["_id"]},
+        {"$set": {"high_water": batch[-1]["_id"]}, "$inc": {"copied": len(batch)}}
+    )
+    return len(batch)
+
+
+def range_digest(coll, rng):
+    """(count, blake2b of the raw BSON of every document in _id order)."""
+    digest = hashlib.blake2b(digest_size=16)
+    count = 0
+    for doc in coll.find(range_query(rng, resume=False)).sort("_id", ASCENDING):
+        digest.update(doc.raw)
+        count += 1
+    return count, digest.hexdigest()
+
+
+def verify_range(source_db, target_db, rng):
+    """Worker process: compare one range between source and target."""
+    coll_name = rng["collection"]
+    source = range_digest(_client[source_db].get_collection(coll_name, codec_options=RAW), rng)
+    target = range_digest(_client[target_db].get_collection(coll_name, codec_options=RAW), rng)
+    result = {
+        "source_count": source[0],
+        "target_count": target[0],
+        "match": source == target,
+    }
+    _client[target_db][CHECKPOINT_COLLECTION].update_one({"_id": rng["_id"]}, {"$set": {"verified": result}})
+    return result
+
+
+def migrate_collection(client, executor, args, coll_name, shard_key):
+    source_coll = client[args.source_db][coll_name]
+    checkpoints = client[args.target_db][CHECKPOINT_COLLECTION]
+
+    total = source_coll.estimated_document_count()
+    if total == 0:
+        print(f"No data in {args.source_db}.{coll_name}")
+        return 0
+
+    plan, created = plan_ranges(source_coll, checkpoints, args.ranges)
+    if created and shard_key:
+        presplit_target(client, source_coll, f"{args.target_db}.{coll_name}", shard_key, args.chunks)
+
+    pending = [r for r in plan if not r["done"]]
+    already = sum(r["copied"] for r in plan)
+    print(f"Migrating ~{total} documents from {args.source_db}.{coll_name} to {args.target_db}.{coll_name}: "
+          f"{already} already copied, {len(pending)}/{len(plan)} ranges remaining...")
+
+    copied = already
+    failed = 0
+    start_time = time.time()
+    futures = {
+        executor.submit(copy_range, args.source_db, args.target_db, r, args.batch_size): r
+        for r in pending
+    }
+    for future in as_completed(futures):
         try:
-            target_coll.insert_many(batch, ordered=False)
+            copied += future.result()
         except Exception as e:
-            print(f"Error inserting final batch: {e}")
-        processed += len(batch)
-        
-    print(f"\nMigration of {coll_name} complete.")
+            # The range keeps its high-water mark; rerun to resume it
+            failed += 1
+            print(f"\nError in range {futures[future]['_id']}: {e}")
+            continue
+        rate = (copied - already) / (time.time() - start_time)
+        print(f"Copied {copied}/{total} ({rate:.0f}/s)...", end='\r')
 
-if __name__ == "__main__":
-    print("Starting migration...")
-    migrate_collection('businesses')
-    migrate_collection('reviews')
-    migrate_collection('users') # Just in case
+    print(f"\nMigration of {coll_name}: {copied} documents" +
+          (f", {failed} ranges failed (rerun to resume)." if failed else " complete."))
+    return failed
+
+
+def verify_collection(client, executor, args, coll_name):
+    checkpoints = client[args.target_db][CHECKPOINT_COLLECTION]
+    plan = list(checkpoints.find({"collection": coll_name}).sort("index", ASCENDING))
+    if not plan:
+        return 0
+    print(f"Verifying {coll_name} ({len(plan)} ranges)...")
+    futures = {executor.submit(verify_range, args.source_db, args.target_db, r): r for r in plan}
+    mismatched = 0
+    source_total = target_total = 0
+    for future in as_completed(futures):
+        rng = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            mismatched += 1
+            print(f"Error verifying range {rng['_id']}: {e}")
+            continue
+        source_total += result["source_count"]
+        target_total += result["target_count"]
+        if not result["match"]:
+            mismatched += 1
+            print(f"MISMATCH in range {rng['_id']} [{rng['lower']}, {rng['upper']}): "
+                  f"{result['source_count']} source vs {result['target_count']} target documents")
+    print(f"{coll_name}: {source_total} source, {target_total} target documents, "
+          f"{len(plan) - mismatched}/{len(plan)} ranges match.")
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel, resumable collection migration through mongos.")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--source-db", default=SOURCE_DB)
+    parser.add_argument("--target-db", default=TARGET_DB)
+    parser.add_argument("--collections", nargs="+", default=COLLECTIONS)
+    parser.add_argument("--workers", type=int, default=8, help="Worker processes")
+    parser.add_argument("--ranges", type=int, default=64, help="_id ranges per collection")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--shard-key", action="append",
+                        help="Shard the target before loading, e.g. reviews=business_id:1,_id:1 or users=user_id:hashed")
+    parser.add_argument("--chunks", type=int, default=64, help="Chunks to pre-split a ranged shard key into")
+    parser.add_argument("--verify-only", action="store_true")
+    parser.add_argument("--no-verify", action="store_true")
+    parser.add_argument("--reset", action="store_true", help="Forget saved ranges and progress")
+    args = parser.parse_args()
+
+    shard_keys = parse_shard_keys(args.shard_key)
+    client = MongoClient(args.uri)
+    failed = 0
+    mismatched = 0
+    try:
+        if args.reset:
+            client[args.target_db][CHECKPOINT_COLLECTION].delete_many({"collection": {"$in": args.collections}})
+            print("Cleared saved ranges.")
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.uri,)) as executor:
+            if not args.verify_only:
+                print("Starting migration...")
+                for coll_name in args.collections:
+                    failed += migrate_collection(client, executor, args, coll_name, shard_keys.get(coll_name))
+            if not args.no_verify:
+                for coll_name in args.collections:
+                    mismatched += verify_collection(client, executor, args, coll_name)
+    finally:
+        client.close()
+
+    if failed or mismatched:
+        print(f"Migration finished with {failed} failed and {mismatched} mismatched ranges.")
+        sys.exit(1)
     print("Migration finished.")
+
+
+if __name__ == "__main__":
+    main()
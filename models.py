@@ -1,13 +1,21 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timezone
 
 class Review(BaseModel):
     business_id: str
     user_id: str
     stars: float
     text: str
-    date: str  # YYYY-MM-DD HH:MM:SS
+    date: datetime  # "YYYY-MM-DD HH:MM:SS" or ISO 8601
+
+    @field_validator("date")
+    @classmethod
+    def naive_utc(cls, value):
+        # Stored like the dataset's dates: BSON datetimes in UTC, compared without tzinfo
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
 
 class Business(BaseModel):
     business_id: str
@@ -24,6 +32,10 @@ class Business(BaseModel):
     attributes: Optional[dict] = None
     categories: Optional[str] = None
     hours: Optional[dict] = None
+    # Maintained incrementally by add_review (see services/rating_aggregates.py)
+    total_stars: Optional[float] = None
+    average_stars: Optional[float] = None
+    star_histogram: Optional[dict] = None
 
 class User(BaseModel):
     user_id: str
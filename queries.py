@@ -0,0 +1,13 @@
+# Query shapes shared by the API routes and query_advisor.py. Kept free of
+# imports with side effects so the advisor can use them without the API's clients.
+
+# Fields the clients never read; not fetched or serialized
+LOCATION_SEARCH_PROJECTION = {"_id": 0, "attributes": 0, "hours": 0}
+BUSINESS_DETAILS_PROJECTION = {"_id": 0, "attributes": 0}
+
+# Served by the {business_id: 1, date: -1, _id: -1} index (database.ensure_indexes)
+REVIEW_SORT = [("date", -1), ("_id", -1)]
+REVIEW_FIELDS = {"text": 1, "stars": 1, "user_id": 1, "date": 1}
+
+# The page size the frontend asks for; only that first page is cached
+REVIEWS_PAGE_SIZE = 50
@@ -0,0 +1,350 @@
+"""
+Query-shape profiler and shard/index advisor.
+
+    python query_advisor.py --samples 20
+    python query_advisor.py --shape reviews_by_business --json report.json
+
+Runs the MongoDB query shapes behind the API routes with sampled real
+parameters, each through explain("executionStats") on mongos, and reports
+per shape: how many shards each query was sent to, documents and keys
+examined vs. returned, the indexes used and any collection scan or
+in-memory sort. Recommends compound indexes (equality, sort, range order)
+and shard keys, in the --shard-key format of migrate_data.py. --json writes
+the full report, for tracking query efficiency over time.
+"""
+import argparse
+import os
+import statistics
+import sys
+from datetime import datetime, timezone
+
+import orjson
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+from queries import LOCATION_SEARCH_PROJECTION, REVIEW_FIELDS, REVIEW_SORT, REVIEWS_PAGE_SIZE
+from services.geo_cache import GEO_CACHE_FETCH_LIMIT
+
+DATABASE = "yelp_data"
+# Examined documents per returned one above which a query counts as unselective
+EXAMINED_RATIO = 10
+USER_PROJECTION = {"_id": 0, "user_id": 1, "name": 1}
+
+
+def near_filter(lon, lat, radius_meters):
+    return {"location": {"$near": {
+        "$geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "$maxDistance": radius_meters
+    }}}
+
+
+# Each shape: the collection it reads, which cluster holds it, how to build
+# one find from a sample, the index that serves it and the shard key that
+# would target it (None where the query cannot be targeted by a shard key).
+SHAPES = [
+    {
+        "name": "geo_near",
+        "route": "GET /search/location",
+        "cluster": "main",
+        "collection": "businesses",
+        "find": lambda s, args: {"filter": near_filter(s["lon"], s["lat"], args.radius),
+                                 "projection": LOCATION_SEARCH_PROJECTION, "limit": 20},
+        "index": {"location": "2dsphere"},
+        "shard_key": None,
+        "note": "$near is never shard-targeted; the geo cache (services/geo_cache.py) "
+                "coalesces these scatter-gathers per cell.",
+    },
+    {
+        "name": "geo_cache_fill",
+        # Fills cover the radius bucket plus the geohash cell; twice the radius approximates that
+        "route": "GET /search/location (geo cache miss)",
+        "cluster": "main",
+        "collection": "businesses",
+        "find": lambda s, args: {"filter": near_filter(s["lon"], s["lat"], args.radius * 2),
+                                 "projection": LOCATION_SEARCH_PROJECTION,
+                                 "limit": GEO_CACHE_FETCH_LIMIT},
+        "index": {"location": "2dsphere"},
+        "shard_key": None,
+        "note": "$near is never shard-targeted; size the geo cache so fills stay rare.",
+    },
+    {
+        "name": "business_details",
+        "route": "GET /business/{business_id}",
+        "cluster": "main",
+        "collection": "businesses",
+        "find": lambda s, args: {"filter": {"business_id": s["business_id"]}, "limit": 1},
+        "index": {"business_id": 1},
+        "shard_key": {"business_id": "hashed"},
+    },
+    {
+        "name": "reviews_by_business",
+        "route": "GET /business/{business_id}/reviews",
+        "cluster": "main",
+        "collection": "reviews",
+        "find": lambda s, args: {"filter": {"business_id": s["business_id"]},
+                                 "projection": REVIEW_FIELDS,
+                                 "sort": dict(REVIEW_SORT),
+                                 "limit": REVIEWS_PAGE_SIZE + 1},
+        "index": {"business_id": 1, "date": -1, "_id": -1},
+        # Ranged, so one business's reviews sit in one chunk; _id keeps hot businesses splittable
+        "shard_key": {"business_id": 1, "_id": 1},
+    },
+    {
+        "name": "users_in",
+        "route": "GET /business/{business_id}/reviews (user names)",
+        "cluster": "users",
+        "collection": "users",
+        "find": lambda s, args: {"filter": {"user_id": {"$in": s["user_ids"]}},
+                                 "projection": USER_PROJECTION},
+        # Covers the projection, so no documents need fetching
+        "index": {"user_id": 1, "name": 1},
+        "shard_key": {"user_id": "hashed"},
+    },
+]
+
+
+def sample_inputs(db, count):
+    """Query parameters drawn from the data: business locations, and business ids weighted like traffic."""
+    businesses = list(db.businesses.aggregate([
+        {"$match": {"location": {"$exists": True}}},
+        {"$sample": {"size": count}},
+        {"$project": {"_id": 0, "business_id": 1, "location": 1}}
+    ]))
+    # Sampling reviews picks businesses in proportion to their review count
+    reviewed = [r["business_id"] for r in db.reviews.aggregate([
+        {"$sample": {"size": count}},
+        {"$project": {"_id": 0, "business_id": 1}}
+    ])]
+    samples = []
+    for i, business in enumerate(businesses):
+        lon, lat = business["location"]["coordinates"]
+        business_id = reviewed[i] if i < len(reviewed) else business["business_id"]
+        # The user ids one page of this business's reviews would look up
+        user_ids = sorted({r["user_id"] for r in db.reviews.find(
+            {"business_id": business_id}, {"_id": 0, "user_id": 1}
+        ).sort(REVIEW_SORT).limit(REVIEWS_PAGE_SIZE) if r.get("user_id")})
+        samples.append({"lon": lon, "lat": lat, "business_id": business_id, "user_ids": user_ids})
+    return samples
+
+
+def explain_find(db, collection, find):
+    command = {"find": collection, **find}
+    return db.command("explain", command, verbosity="executionStats")
+
+
+def plan_stages(plan):
+    """Every stage of a winning plan, through queryPlan, input stages and per-shard plans."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan
+    for key in ("queryPlan", "winningPlan", "inputStage"):
+        yield from plan_stages(plan.get(key))
+    for key in ("inputStages", "shards"):
+        for child in plan.get(key) or []:
+            yield from plan_stages(child)
+
+
+def summarize_explain(explain):
+    winning = explain["queryPlanner"]["winningPlan"]
+    stats = explain["executionStats"]
+    stages = list(plan_stages(winning))
+    shards = [shard["shardName"] for shard in winning.get("shards") or []]
+    return {
+        "shards": shards,
+        "returned": stats["nReturned"],
+        "docs_examined": stats["totalDocsExamined"],
+        "keys_examined": stats["totalKeysExamined"],
+        "time_ms": stats["executionTimeMillis"],
+        "indexes": sorted({stage["indexName"] for stage in stages if "indexName" in stage}),
+        "collscan": any(stage["stage"] == "COLLSCAN" for stage in stages),
+        # Blocking sort in memory, as opposed to SHARD_MERGE_SORT of index-ordered shard results
+        "in_memory_sort": any(stage["stage"] == "SORT" for stage in stages),
+    }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def aggregate_runs(runs, cluster_shards):
+    times = sorted(run["time_ms"] for run in runs)
+    returned = sum(run["returned"] for run in runs)
+    docs_examined = sum(run["docs_examined"] for run in runs)
+    targeted = [len(run["shards"]) for run in runs]
+    scattered = sum(1 for n in targeted if len(cluster_shards) > 1 and n == len(cluster_shards))
+    return {
+        "queries": len(runs),
+        "p50_ms": percentile(times, 50),
+        "p95_ms": percentile(times, 95),
+        "max_ms": times[-1] if times else 0,
+        "returned": returned,
+        "docs_examined": docs_examined,
+        "keys_examined": sum(run["keys_examined"] for run in runs),
+        "examined_per_returned": round(docs_examined / returned, 2) if returned else None,
+        "mean_shards_targeted": round(statistics.mean(targeted), 2) if targeted else 0,
+        "scatter_fraction": round(scattered / len(runs), 2) if runs else 0,
+        "indexes": sorted({name for run in runs for name in run["indexes"]}),
+        "collscan": any(run["collscan"] for run in runs),
+        "in_memory_sort": any(run["in_memory_sort"] for run in runs),
+    }
+
+
+def index_key(key):
+    # index_information() reports numeric directions as floats or ints
+    return [(field, int(kind) if isinstance(kind, (int, float)) else kind) for field, kind in key]
+
+
+def key_spec(collection, key):
+    """migrate_data.py --shard-key format: reviews=business_id:1,_id:1"""
+    return f"{collection}=" + ",".join(f"{field}:{kind}" for field, kind in key.items())
+
+
+def recommend(shape, summary, cluster):
+    """Index and shard-key recommendations for one shape."""
+    collection = shape["collection"]
+    recommendations = []
+    index = shape["index"]
+    has_index = index_key(index.items()) in [index_key(key) for key in cluster["indexes"].get(collection, [])]
+    reasons = []
+    if summary["collscan"]:
+        reasons.append("collection scan")
+    if summary["in_memory_sort"]:
+        reasons.append("in-memory sort")
+    ratio = summary["examined_per_returned"]
+    if ratio is not None and ratio > EXAMINED_RATIO:
+        reasons.append(f"{ratio} documents examined per returned")
+    if not has_index and shape["name"] == "users_in" and summary["docs_examined"]:
+        reasons.append("documents fetched for a projection an index could cover")
+    if reasons:
+        recommendation = {"type": "index", "collection": collection, "key": index, "reason": ", ".join(reasons)}
+        if has_index:
+            recommendation["type"] = "note"
+            recommendation["reason"] += f"; index {index} exists but the planner used {summary['indexes'] or 'none'}"
+        recommendations.append(recommendation)
+
+    if len(cluster["shards"]) > 1 and summary["scatter_fraction"] > 0:
+        current = cluster["shard_keys"].get(collection)
+        target = shape["shard_key"]
+        if target is None:
+            recommendations.append({"type": "note", "collection": collection, "reason": shape["note"]})
+        elif current is None or next(iter(current)) != next(iter(target)):
+            recommendations.append({
+                "type": "shard_key", "collection": collection, "key": target,
+                "spec": key_spec(collection, target),
+                "current": current,
+                "reason": f"{int(summary['scatter_fraction'] * 100)}% of queries went to all "
+                          f"{len(cluster['shards'])} shards",
+            })
+    return recommendations
+
+
+def cluster_info(client, collections):
+    """Shards, shard keys and index keys of the given collections; no shards off mongos."""
+    try:
+        shards = [shard["_id"] for shard in client.admin.command("listShards")["shards"]]
+    except OperationFailure:
+        shards = []
+    shard_keys = {}
+    if shards:
+        for entry in client.config.collections.find(
+                {"_id": {"$in": [f"{DATABASE}.{name}" for name in collections]}}):
+            shard_keys[entry["_id"].split(".", 1)[1]] = dict(entry["key"])
+    db = client[DATABASE]
+    indexes = {name: [info["key"] for info in db[name].index_information().values()] for name in collections}
+    return {"shards": shards, "shard_keys": shard_keys, "indexes": indexes}
+
+
+def print_shape(result, out):
+    s = result["summary"]
+    print(f"\n{result['name']} ({result['route']}) on {result['collection']}", file=out)
+    print(f"  {s['queries']} queries: p50 {s['p50_ms']} ms, p95 {s['p95_ms']} ms, max {s['max_ms']} ms", file=out)
+    print(f"  shards targeted {s['mean_shards_targeted']} (scatter {int(s['scatter_fraction'] * 100)}%), "
+          f"examined {s['docs_examined']} docs / {s['keys_examined']} keys for {s['returned']} returned", file=out)
+    print(f"  indexes {', '.join(s['indexes']) or 'none'}"
+          f"{', COLLSCAN' if s['collscan'] else ''}{', in-memory SORT' if s['in_memory_sort'] else ''}", file=out)
+    for rec in result["recommendations"]:
+        if rec["type"] == "shard_key":
+            print(f"  -> shard key {rec['key']} (now {rec['current']}): {rec['reason']}; "
+                  f"migrate_data.py --shard-key {rec['spec']}", file=out)
+        elif rec["type"] == "index":
+            print(f"  -> index {rec['key']}: {rec['reason']}", file=out)
+        else:
+            print(f"  -> {rec['reason']}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain the API's query shapes and recommend indexes and shard keys.")
+    # Same variables as database.py, which isn't imported: it opens the API's clients
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"),
+                        help="mongos of the main cluster")
+    parser.add_argument("--users-uri", default=os.environ.get("MONGO_USERS_URI", "mongodb://localhost:27018"))
+    parser.add_argument("--samples", type=int, default=20, help="Sampled queries per shape")
+    parser.add_argument("--radius", type=int, default=5000, help="$maxDistance of geo queries, in meters")
+    parser.add_argument("--shape", action="append", choices=[shape["name"] for shape in SHAPES],
+                        help="Only these shapes (default: all)")
+    parser.add_argument("--json", help="Write the report to this file ('-' for stdout)")
+    parser.add_argument("--per-query", action="store_true", help="Include every query's explain summary in the JSON")
+    args = parser.parse_args()
+
+    shapes = [shape for shape in SHAPES if not args.shape or shape["name"] in args.shape]
+    # With --json - stdout carries only the JSON report
+    out = sys.stderr if args.json == "-" else sys.stdout
+    clients = {"main": MongoClient(args.uri), "users": MongoClient(args.users_uri)}
+    try:
+        samples = sample_inputs(clients["main"][DATABASE], args.samples)
+        if not samples:
+            print("No businesses to sample queries from.", file=out)
+            sys.exit(1)
+        clusters = {
+            name: cluster_info(client, sorted({s["collection"] for s in shapes if s["cluster"] == name}))
+            for name, client in clients.items()
+        }
+        results = []
+        for shape in shapes:
+            db = clients[shape["cluster"]][DATABASE]
+            cluster = clusters[shape["cluster"]]
+            runs = []
+            for sample in samples:
+                if shape["name"] == "users_in" and not sample["user_ids"]:
+                    continue
+                find = shape["find"](sample, args)
+                runs.append(summarize_explain(explain_find(db, shape["collection"], find)))
+            summary = aggregate_runs(runs, cluster["shards"])
+            result = {
+                "name": shape["name"],
+                "route": shape["route"],
+                "collection": shape["collection"],
+                "cluster_shards": len(cluster["shards"]),
+                "shard_key": cluster["shard_keys"].get(shape["collection"]),
+                "summary": summary,
+                "recommendations": recommend(shape, summary, cluster) if runs else [],
+            }
+            if args.per_query:
+                result["queries"] = runs
+            results.append(result)
+            print_shape(result, out)
+    finally:
+        for client in clients.values():
+            client.close()
+
+    if args.json:
+        report = {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "samples": args.samples,
+            "radius_meters": args.radius,
+            "shapes": results,
+        }
+        data = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+        if args.json == "-":
+            sys.stdout.buffer.write(data + b"\n")
+        else:
+            with open(args.json, "wb") as f:
+                f.write(data)
+            print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
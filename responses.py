@@ -0,0 +1,27 @@
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import Response
+
+
+def _bson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(data):
+    # Naive datetimes from pymongo are UTC; orjson writes them as RFC 3339
+    return orjson.dumps(data, default=_bson_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+
+
+class BSONResponse(Response):
+    """
+    JSON response for raw pymongo documents, serialized once with orjson.
+    Return it from the route directly so FastAPI skips jsonable_encoder.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
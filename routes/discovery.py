@@ -1,75 +1,219 @@
-from fastapi import APIRouter
-from database import db_read, db_users
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from database import async_db_primary_read, async_db_read, async_db_users
+from queries import (
+    BUSINESS_DETAILS_PROJECTION, LOCATION_SEARCH_PROJECTION, REVIEW_FIELDS, REVIEW_SORT, REVIEWS_PAGE_SIZE
+)
+from responses import BSONResponse, dumps
+from services.causal import CAUSAL_TOKEN_HEADER, read_after
+from services.geo_cache import geo_cache
+from services.metrics import StageTimer, register_cache
+from services.response_cache import response_cache
+from services.user_cache import UserNameCache
 from bson import json_util
-import json
+from typing import Optional
+import base64
 
 router = APIRouter()
 
-def parse_json(data):
-    return json.loads(json_util.dumps(data))
+user_cache = UserNameCache(async_db_users.users)
+register_cache("user", user_cache)
 
 @router.get("/search/location")
-def search_by_location(lat: float, long: float, radius_meters: int = 5000):
+async def search_by_location(lat: float, long: float, radius_meters: int = 5000):
     # Maps to the query shown in report [cite: 644]
-    query = {
-        "location": {
-            "$near": {
-                "$geometry": {
-                    "type": "Point",
-                    "coordinates": [long, lat]
-                },
-                "$maxDistance": radius_meters
-            }
-        }
-    }
-    # Use db_read (Secondary Preferred)
-    results = list(db_read.businesses.find(query).limit(20))
-    return parse_json(results)
+    # Served from the geo-cell cache: nearby requests share one $near scatter-gather,
+    # re-sorted by exact distance in-process
+    # Use async_db_read (Secondary Preferred)
+    timer = StageTimer("search_location")
+    results = await geo_cache.find_near(async_db_read.businesses, long, lat, radius_meters, limit=20,
+                                        projection=LOCATION_SEARCH_PROJECTION)
+    timer.mark("geo_lookup")
+    response = BSONResponse(results)
+    timer.mark("serialize")
+    return response
 
-@router.get("/business/{business_id}/reviews")
-def get_business_reviews(business_id: str):
-    # 1. Fetch reviews from Main DB
-    reviews = list(db_read.reviews.find(
-        {"business_id": business_id},
-        {"text": 1, "stars": 1, "user_id": 1, "date": 1}
-    ).sort("date", -1).limit(50)) # Limit to 50 for performance
+@router.get("/search/location/cache")
+async def geo_cache_stats():
+    return geo_cache.stats()
 
-    if not reviews:
-        return []
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+def cached_json(request, entry):
+    """Serve a ResponseCache entry, or 304 if the client already has this version."""
+    headers = {"ETag": entry.etag, **entry.headers}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
 
+@router.get("/business/cache")
+async def response_cache_stats():
+    return response_cache.stats()
+
+def encode_cursor(review):
+    # json_util keeps the BSON types of date and _id
+    raw = json_util.dumps([review.get("date"), review["_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, _id = json_util.loads(base64.urlsafe_b64decode(padded))
+        return date, _id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def reviews_after(business_id, cursor):
+    """Filter for reviews strictly after the cursor position in REVIEW_SORT order."""
+    query = {"business_id": business_id}
+    if cursor is None:
+        return query
+    date, _id = decode_cursor(cursor)
+    query["$or"] = [
+        {"date": {"$lt": date}},
+        {"date": date, "_id": {"$lt": _id}},
+    ]
+    return query
+
+async def enrich_reviews(reviews):
     # 2. Collect User IDs
     user_ids = list(set([r.get("user_id") for r in reviews if r.get("user_id")]))
 
     # 3. Fetch User Details from Users Service
-    users_map = {}
-    if user_ids:
-        try:
-            users = list(db_users.users.find(
-                {"user_id": {"$in": user_ids}},
-                {"user_id": 1, "name": 1}
-            ))
-            users_map = {u["user_id"]: u for u in users}
-        except Exception as e:
-            print(f"Error fetching users: {e}")
-            # Continue without user details if users service fails
+    # Cached, coalesced and time-boxed; names are simply missing if the users service fails
+    users_map = await user_cache.get_names(user_ids) if user_ids else {}
 
     # 4. Merge Data
     enriched_reviews = []
     for r in reviews:
-        user = users_map.get(r.get("user_id"))
+        name = users_map.get(r.get("user_id"))
         review_data = {
             "text": r.get("text"),
             "stars": r.get("stars"),
             "date": r.get("date"),
-            "user_details": {"name": user.get("name", "Unknown User")} if user else {"name": "Unknown User"}
+            "user_details": {"name": name or "Unknown User"}
         }
         enriched_reviews.append(review_data)
+    return enriched_reviews
+
+async def stream_reviews(cursor, limit, batch_size=100):
+    """NDJSON: one review per line, enriched per batch; a final {"next_cursor": ...} line if more remain."""
+    batch = []
+    sent = 0
+    last = None
+    async for review in cursor:
+        if sent + len(batch) == limit:
+            # The limit+1-th document only tells us there is another page
+            batch = await enrich_reviews(batch) if batch else []
+            for review_data in batch:
+                yield dumps(review_data) + b"\n"
+            yield dumps({"next_cursor": encode_cursor(last)}) + b"\n"
+            return
+        batch.append(review)
+        last = review
+        if len(batch) >= batch_size:
+            for review_data in await enrich_reviews(batch):
+                yield dumps(review_data) + b"\n"
+            sent += len(batch)
+            batch = []
+    for review_data in (await enrich_reviews(batch) if batch else []):
+        yield dumps(review_data) + b"\n"
 
-    return parse_json(enriched_reviews)
+@router.get("/users/cache")
+async def user_cache_stats():
+    return user_cache.stats()
+
+async def find_reviews_page(db, business_id, cursor, limit, session=None):
+    # One extra review tells whether another page follows
+    return await db.reviews.find(
+        reviews_after(business_id, cursor), REVIEW_FIELDS, session=session
+    ).sort(REVIEW_SORT).limit(limit + 1).to_list()
+
+async def load_reviews_page(business_id, cursor, limit, timer, causal_token=None):
+    """(enriched reviews, headers) for one page of a business's reviews."""
+    # 1. Fetch reviews from Main DB, no older than the caller's last write if a token was sent
+    if causal_token:
+        reviews = await read_after(causal_token, lambda db, session: find_reviews_page(
+            db, business_id, cursor, limit, session))
+    else:
+        reviews = await find_reviews_page(async_db_read, business_id, cursor, limit)
+    timer.mark("mongo_find")
+    headers = {}
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(reviews[-1])
+    if not reviews:
+        return [], headers
+    enriched = await enrich_reviews(reviews)
+    timer.mark("enrich_users")
+    return enriched, headers
+
+@router.get("/business/{business_id}/reviews")
+async def get_business_reviews(business_id: str,
+                               request: Request,
+                               limit: int = Query(REVIEWS_PAGE_SIZE, ge=1, le=1000),
+                               cursor: Optional[str] = None,
+                               stream: bool = False,
+                               causal_token: Optional[str] = Header(None, alias=CAUSAL_TOKEN_HEADER)):
+    """
+    Newest reviews first, paged by an opaque keyset cursor over (date, _id).
+    The next page's cursor comes back in the X-Next-Cursor header.
+    With stream=true the page is sent as NDJSON while it is being read.
+    The default first page is served from the response cache with an ETag.
+    With the X-Causal-Token of a write, the page includes that write and
+    bypasses the cache.
+    """
+    if stream:
+        # The stream outlives a causal session; after a write, read the primary instead
+        db = async_db_primary_read if causal_token else async_db_read
+        mongo_cursor = db.reviews.find(
+            reviews_after(business_id, cursor), REVIEW_FIELDS
+        ).sort(REVIEW_SORT).limit(limit + 1)
+        return StreamingResponse(stream_reviews(mongo_cursor, limit), media_type="application/x-ndjson")
+
+    timer = StageTimer("business_reviews")
+    if cursor is None and limit == REVIEWS_PAGE_SIZE and not causal_token:
+        async def load():
+            reviews, headers = await load_reviews_page(business_id, None, limit, timer)
+            body = dumps(reviews)
+            timer.mark("serialize")
+            return body, headers
+        entry = await response_cache.get_or_load(business_id, "reviews", load)
+        timer.mark("response_cache")
+        return cached_json(request, entry)
+
+    reviews, headers = await load_reviews_page(business_id, cursor, limit, timer, causal_token)
+    if not reviews:
+        return []
+    response = BSONResponse(reviews, headers=headers)
+    timer.mark("serialize")
+    return response
 
 @router.get("/business/{business_id}")
-def get_business_details(business_id: str):
-    business = db_read.businesses.find_one({"business_id": business_id})
-    if not business:
-        return {}
-    return parse_json(business)
+async def get_business_details(business_id: str, request: Request,
+                               causal_token: Optional[str] = Header(None, alias=CAUSAL_TOKEN_HEADER)):
+    timer = StageTimer("business_details")
+    if causal_token:
+        # Aggregates as of the caller's last write; not cached
+        business = await read_after(causal_token, lambda db, session: db.businesses.find_one(
+            {"business_id": business_id}, BUSINESS_DETAILS_PROJECTION, session=session))
+        timer.mark("mongo_find")
+        response = BSONResponse(business or {})
+        timer.mark("serialize")
+        return response
+
+    async def load():
+        business = await async_db_read.businesses.find_one({"business_id": business_id},
+                                                            BUSINESS_DETAILS_PROJECTION)
+        timer.mark("mongo_find")
+        body = dumps(business or {})
+        timer.mark("serialize")
+        return body, {}
+    entry = await response_cache.get_or_load(business_id, "details", load)
+    timer.mark("response_cache")
+    return cached_json(request, entry)
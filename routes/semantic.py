@@ -1,106 +1,205 @@
-from fastapi import APIRouter, HTTPException
-from database import db_read
+from fastapi import APIRouter, HTTPException, Depends, Query
+from database import async_db_read
 from models import Business
-import weaviate
-import ollama
+from responses import BSONResponse
+from services.weaviate_pool import async_weaviate_pool
+from services.embedding_cache import aembed_query, embedding_cache
+from services.geo_cache import geo_cache
+from services.metrics import ERRORS, StageTimer
+from services.review_schema import REVIEW_COLLECTION
+from services.semantic_rerank import candidate_relevance, rerank
+from weaviate.classes.query import Filter, HybridFusion
+from weaviate.classes.data import GeoCoordinate
+import asyncio
 import os
+from typing import Literal
 
 router = APIRouter()
 
+# "business_ids": $near in MongoDB then containsAny on business_id; works on any index.
+# "weaviate": geo-filter on the Review 'location' property. Only switch to it after
+# `backfill_weaviate.py --locations` has run: reviews without a location never match.
+GEO_FILTER_MODE = os.environ.get("SEMANTIC_GEO_FILTER", "business_ids")
+# Reviews fetched from Weaviate before grouping and reranking by business
+SEMANTIC_CANDIDATES = int(os.environ.get("SEMANTIC_CANDIDATES", "200"))
+
+BUSINESS_PROJECTION = {
+    "business_id": 1,
+    "name": 1,
+    "city": 1,
+    "stars": 1,
+    "review_count": 1,
+    "categories": 1,
+    "address": 1,
+    "location": 1
+}
+
 # Weaviate Connection
-# In a production app, this should be a singleton dependency
-def get_weaviate_client():
-    return weaviate.connect_to_local(
-        port=8080,
-        grpc_port=50051,
-        headers={}
-    )
+# Borrowed from the shared pool (opened in the app lifespan), not connected per request
+async def get_weaviate_client():
+    try:
+        async with async_weaviate_pool.client() as client:
+            yield client
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Weaviate pool exhausted")
+
+@router.get("/search/semantic/cache")
+async def embedding_cache_stats():
+    # Hit/miss counters for sizing the query-embedding cache
+    return embedding_cache.stats()
+
+async def embed_or_fail(query):
+    try:
+        return await aembed_query(query)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
 
 @router.get("/search/semantic")
-def search_semantic(query: str, lat: float, long: float, radius_meters: int = 5000):
+async def search_semantic(query: str, lat: float, long: float, radius_meters: int = 5000,
+                          page: int = Query(1, ge=1),
+                          page_size: int = Query(10, ge=1, le=50),
+                          mode: Literal["vector", "hybrid", "keyword"] = "vector",
+                          alpha: float = Query(0.5, ge=0, le=1),
+                          client=Depends(get_weaviate_client)):
     """
-    Semantic search for reviews within a specific location radius.
-    1. Find businesses in MongoDB within radius.
-    2. Vector search Weaviate for reviews matching 'query', filtered by those businesses.
-    3. Return reviews with business metadata.
+    Semantic search for businesses within a specific location radius.
+    1. Embed 'query' with the configured embedding backend.
+    2. Search Weaviate for up to SEMANTIC_CANDIDATES reviews matching 'query'
+       within the radius (geo filter on the indexed review location):
+       - mode=vector: near_vector on the embedding
+       - mode=hybrid: BM25 on review text fused with the vector score; alpha
+         weights the vector side (alpha=0 is pure BM25 and skips step 1)
+       - mode=keyword: BM25 only, no embedding call
+    3. Group the reviews by business and rerank businesses by a blend of
+       review relevance, rating and distance (services.semantic_rerank).
+    4. Return one page of business hits with per-stage timings.
+    In "business_ids" mode, step 2 instead filters on the IDs of businesses found
+    by a MongoDB $near query, run concurrently with step 1.
     """
+    # Also recorded in request_stage_duration_seconds on /metrics
+    timer = StageTimer("search_semantic")
+    stage = timer.mark
+
+    search_type = mode
+    if mode == "hybrid" and alpha == 0:
+        search_type = "keyword"
+    needs_vector = search_type != "keyword"
+
     try:
-        # 1. Geo-Filter: Get Business IDs from MongoDB
-        mongo_query = {
-            "location": {
-                "$near": {
-                    "$geometry": {
-                        "type": "Point",
-                        "coordinates": [long, lat]
-                    },
-                    "$maxDistance": radius_meters
-                }
-            }
-        }
-        # Projection: Get details for UI
-        nearby_businesses = list(db_read.businesses.find(mongo_query, {
-            "business_id": 1, 
-            "name": 1, 
-            "city": 1, 
-            "stars": 1, 
-            "review_count": 1, 
-            "categories": 1,
-            "address": 1
-        }))
-        
-        if not nearby_businesses:
-            return []
-
-        business_ids = [b["business_id"] for b in nearby_businesses]
-        business_map = {b["business_id"]: b for b in nearby_businesses}
-
-        # 2. Generate Embedding using Ollama
-        try:
-            embedding_response = ollama.embed(model='all-minilm', input=query)
-            vector = embedding_response['embeddings'][0]
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ollama embedding failed: {str(e)}")
-
-        # 3. Vector Search in Weaviate with Filter
-        client = get_weaviate_client()
-        try:
-            reviews_collection = client.collections.get("Review")
-            
-            from weaviate.classes.query import Filter
+        if GEO_FILTER_MODE == "business_ids":
+            # 1. Geo-Filter: Get Business IDs from MongoDB
+            # $near via the geo-cell cache, shared with /search/location
+            # Projection: Get details for UI
+            geo_lookup = geo_cache.find_near(async_db_read.businesses, long, lat, radius_meters,
+                                             projection=BUSINESS_PROJECTION)
+
+            # 2. Generate Embedding (cached per normalized query)
+            # Runs alongside the $near scatter-gather instead of after it
+            if needs_vector:
+                nearby_businesses, vector = await asyncio.gather(geo_lookup, embed_or_fail(query))
+                stage("embed_and_geo")
+            else:
+                nearby_businesses, vector = await geo_lookup, None
+                stage("geo")
+
+            if not nearby_businesses:
+                return search_page([], page, page_size, timer)
+
+            business_ids = [b["business_id"] for b in nearby_businesses]
+            business_map = {b["business_id"]: b for b in nearby_businesses}
 
             # Filter: business_id must be in our list of nearby business_ids
-            # Weaviate 'containsAny' is perfect for this
-            response = reviews_collection.query.near_vector(
+            geo_filter = Filter.by_property("business_id").contains_any(business_ids)
+        else:
+            # 1. Generate Embedding (cached per normalized query)
+            vector = None
+            if needs_vector:
+                vector = await embed_or_fail(query)
+                stage("embed")
+            business_map = None
+
+            # Filter: review location within the radius, evaluated inside Weaviate
+            geo_filter = Filter.by_property("location").within_geo_range(
+                coordinate=GeoCoordinate(latitude=lat, longitude=long),
+                distance=radius_meters
+            )
+
+        # 2. Search Weaviate with Filter
+        # A wide candidate set so the page is not filled by one business's reviews
+        reviews_collection = client.collections.get(REVIEW_COLLECTION)
+        if search_type == "vector":
+            response = await reviews_collection.query.near_vector(
                 near_vector=vector,
-                limit=20, # Fetch more to group by business
-                filters=Filter.by_property("business_id").contains_any(business_ids),
+                limit=SEMANTIC_CANDIDATES,
+                filters=geo_filter,
+                return_properties=["business_id", "text"],
                 return_metadata=["distance"]
             )
-            
-            results = []
-            for obj in response.objects:
-                review_data = obj.properties
-                bid = review_data.get("business_id")
-                
-                # Attach business details
-                business_info = business_map.get(bid, {})
-                
-                results.append({
-                    "review_text": review_data.get("text"),
-                    "business_name": business_info.get("name"),
-                    "business_city": business_info.get("city"),
-                    "business_stars": business_info.get("stars"),
-                    "business_review_count": business_info.get("review_count"),
-                    "business_categories": business_info.get("categories"),
-                    "business_id": bid,
-                    "score": obj.metadata.distance
-                })
-                
-            return results
-
-        finally:
-            client.close()
+        elif search_type == "hybrid":
+            # Relative-score fusion keeps scores in [0, 1] for the rerank blend
+            response = await reviews_collection.query.hybrid(
+                query=query,
+                vector=vector,
+                alpha=alpha,
+                query_properties=["text"],
+                fusion_type=HybridFusion.RELATIVE_SCORE,
+                limit=SEMANTIC_CANDIDATES,
+                filters=geo_filter,
+                return_properties=["business_id", "text"],
+                return_metadata=["score"]
+            )
+        else:
+            response = await reviews_collection.query.bm25(
+                query=query,
+                query_properties=["text"],
+                limit=SEMANTIC_CANDIDATES,
+                filters=geo_filter,
+                return_properties=["business_id", "text"],
+                return_metadata=["score"]
+            )
+        relevance = candidate_relevance(response.objects, search_type)
+        candidates = [
+            {
+                "business_id": obj.properties.get("business_id"),
+                "text": obj.properties.get("text"),
+                "relevance": score
+            }
+            for obj, score in zip(response.objects, relevance)
+        ]
+        stage(f"{search_type}_search")
+
+        if business_map is None:
+            # Business details only for the businesses in the candidate set
+            hit_ids = list({c["business_id"] for c in candidates})
+            businesses = await async_db_read.businesses.find(
+                {"business_id": {"$in": hit_ids}}, BUSINESS_PROJECTION
+            ).to_list() if hit_ids else []
+            business_map = {b["business_id"]: b for b in businesses}
+            stage("business_lookup")
+
+        # 3. Group by business and rerank
+        hits = rerank(candidates, business_map, lat, long, radius_meters)
+        stage("rerank")
 
+        return search_page(hits, page, page_size, timer)
+
+    except HTTPException:
+        raise
     except Exception as e:
+        ERRORS.inc("semantic_search")
         print(f"Error in semantic search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def search_page(hits, page, page_size, timer):
+    offset = (page - 1) * page_size
+    timings = dict(timer.timings, total=timer.total_ms())
+    response = BSONResponse({
+        "results": hits[offset:offset + page_size],
+        "page": page,
+        "page_size": page_size,
+        "total": len(hits),
+        "timings_ms": timings
+    })
+    # Only in the histogram: the body is already encoded by now
+    timer.mark("serialize")
+    return response
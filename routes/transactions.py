@@ -1,40 +1,251 @@
-from fastapi import APIRouter, HTTPException
-from database import client, db_write
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from database import async_db_write
 from models import Review
+from services.causal import CAUSAL_TOKEN_HEADER, causal_session, encode_token
+from services.geo_cache import geo_cache
+from services.metrics import ERRORS
+from services.response_cache import response_cache
+from services.rating_aggregates import AGGREGATE_MODE, AggregateBuffer, RatingDelta, aggregate_updates
+import orjson
 
 router = APIRouter()
 
+# Reviews per insert_many / aggregate bulk_write in /reviews:bulk
+BULK_CHUNK_SIZE = 1000
+
+# Collects deltas when AGGREGATE_MODE is "batched", and failed inline updates
+# in either mode; its flush loop is started/stopped by the app lifespan
+aggregate_buffer = AggregateBuffer(async_db_write.businesses)
+
 @router.post("/add_review")
-def add_review(review_data: Review):
-    # Start a Client Session for the Transaction
-    with client.start_session() as session:
-        with session.start_transaction():
-            try:
-                # 1. Insert the Review
-                reviews_col = db_write.reviews
-                review_dict = review_data.dict()
-                reviews_col.insert_one(review_dict, session=session)
-
-                # 2. Update Business Aggregates (Atomically)
-                business_col = db_write.businesses
-                
-                # Logic: Fetch current stats first if calculation is complex, 
-                # or use pure Mongo operators ($inc) if possible.
-                # Per report[cite: 828], you calculate new average.
-                
-                business_col.update_one(
+async def add_review(review_data: Review, response: Response):
+    # No multi-document transaction: the business aggregates are a single-document
+    # atomic update, so nothing here needs a cross-shard commit
+    delta = RatingDelta.for_review(review_data.stars, review_data.date)
+    business_col = async_db_write.businesses
+    # Causal session: the returned token lets the client's next reads see this write
+    async with causal_session() as session:
+        try:
+            # 1. Update Business Aggregates (Atomically)
+            # Running total_stars/review_count/star_histogram, average recomputed in the same update
+            if AGGREGATE_MODE == "batched":
+                business = await business_col.find_one(
                     {"business_id": review_data.business_id},
-                    {
-                        "$inc": {"review_count": 1},
-                        # Note: Updating average precisely requires complex math or 
-                        # storing 'total_stars'. Simplified here for brevity:
-                        "$set": {"last_updated": review_data.date} 
-                    },
+                    {"location": 1, "state": 1},
                     session=session
                 )
-                
-                # Transaction commits automatically if no exception
-                return {"status": "Review added and aggregates updated"}
+            else:
+                business = await business_col.find_one_and_update(
+                    {"business_id": review_data.business_id},
+                    delta.pipeline(),
+                    projection={"location": 1, "state": 1},
+                    session=session
+                )
+
+            # 2. Insert the Review
+            # Enriched with the business's state/location like the bulk-loaded reviews,
+            # so the Weaviate sync can index it for geo-filtered search
+            reviews_col = async_db_write.reviews
+            review_dict = review_data.dict()
+            if business:
+                review_dict["state"] = business.get("state")
+                review_dict["location"] = business.get("location")
+            try:
+                await reviews_col.insert_one(review_dict, session=session)
+            except Exception:
+                if business and AGGREGATE_MODE != "batched":
+                    # Compensate the aggregate update made in step 1
+                    await business_col.update_one(
+                        {"business_id": review_data.business_id},
+                        delta.negated().pipeline(),
+                        session=session
+                    )
+                raise
+
+            if AGGREGATE_MODE == "batched" and business:
+                aggregate_buffer.add(review_data.business_id, delta)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        token = encode_token(session)
+
+    # 3. Drop cached geo results and responses that include this business
+    response_cache.invalidate(review_data.business_id)
+    if business and business.get("location"):
+        lon, lat = business["location"]["coordinates"]
+        geo_cache.invalidate_point(lon, lat)
+
+    if token:
+        response.headers[CAUSAL_TOKEN_HEADER] = token
+    return {"status": "Review added and aggregates updated"}
+
+
+async def _write_review_chunk(items, session):
+    """
+    Insert one chunk of (index, raw) reviews and apply their aggregates.
+    Returns (a status dict per item, error or None). Nothing is raised, so
+    the caller can still report what earlier chunks wrote.
+    """
+    statuses = {}
+    reviews = []
+    for index, raw in items:
+        try:
+            reviews.append((index, Review.model_validate(raw)))
+        except ValidationError as e:
+            statuses[index] = {"index": index, "status": "error", "error": e.errors(include_url=False, include_context=False)}
+
+    # One lookup for every business in the chunk (for enrichment and existence)
+    business_ids = list({review.business_id for _, review in reviews})
+    businesses = {}
+    if business_ids:
+        try:
+            cursor = async_db_write.businesses.find(
+                {"business_id": {"$in": business_ids}},
+                {"business_id": 1, "location": 1, "state": 1},
+                session=session
+            )
+            businesses = {b["business_id"]: b for b in await cursor.to_list()}
+        except Exception as e:
+            # Nothing written for this chunk yet
+            for index, _ in reviews:
+                statuses[index] = {"index": index, "status": "error", "error": f"not written: {e}"}
+            return [statuses[index] for index, _ in items], str(e)
+
+    to_insert = []
+    for index, review in reviews:
+        business = businesses.get(review.business_id)
+        if business is None:
+            statuses[index] = {"index": index, "status": "error", "error": "unknown business_id"}
+            continue
+        review_dict = review.dict()
+        review_dict["state"] = business.get("state")
+        review_dict["location"] = business.get("location")
+        to_insert.append((index, review, review_dict))
+
+    failed = {}
+    if to_insert:
+        try:
+            await async_db_write.reviews.insert_many([d for _, _, d in to_insert], ordered=False,
+                                                   session=session)
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+        except Exception as e:
+            # Some of the chunk may be written; the ids let the client check before retrying
+            for index, _, review_dict in to_insert:
+                statuses[index] = {"index": index, "status": "error", "error": f"write outcome unknown: {e}",
+                                   "id": str(review_dict["_id"])}
+            return [statuses[index] for index, _ in items], str(e)
+
+    deltas = {}
+    for position, (index, review, review_dict) in enumerate(to_insert):
+        if position in failed:
+            statuses[index] = {"index": index, "status": "error", "error": failed[position]}
+            continue
+        statuses[index] = {"index": index, "status": "ok", "id": str(review_dict["_id"])}
+        deltas.setdefault(review.business_id, RatingDelta()).add(review.stars, review.date)
+
+    # Grouped per-business aggregate updates
+    if deltas:
+        if AGGREGATE_MODE == "batched":
+            for business_id, delta in deltas.items():
+                aggregate_buffer.add(business_id, delta)
+        else:
+            items = list(deltas.items())
+            try:
+                await async_db_write.businesses.bulk_write(aggregate_updates(dict(items)), ordered=False,
+                                                           session=session)
             except Exception as e:
-                # Transaction aborts automatically on error
-                raise HTTPException(status_code=500, detail=str(e))
+                # The reviews are written, so they stay "ok"; the failed updates are
+                # retried by the buffer's flush loop, which runs in inline mode too
+                aggregate_buffer.requeue(items, e)
+        for business_id in deltas:
+            response_cache.invalidate(business_id)
+            location = businesses[business_id].get("location")
+            if location:
+                lon, lat = location["coordinates"]
+                geo_cache.invalidate_point(lon, lat)
+
+    return [statuses[index] for index, _ in items], None
+
+
+async def _iter_bulk_body(request):
+    """Reviews from a JSON array body, or one JSON object per line for application/x-ndjson."""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+    else:
+        try:
+            payload = orjson.loads(await request.body())
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of reviews")
+        for raw in payload:
+            yield raw
+
+
+@router.post("/reviews:bulk")
+async def add_reviews_bulk(request: Request, response: Response):
+    """
+    Bulk review ingestion. Accepts a JSON array or an NDJSON stream of reviews,
+    writes them in chunks with unordered insert_many plus one grouped
+    aggregate bulk_write per chunk, and returns a status per item.
+    If a chunk fails, the remaining items are reported as not written rather
+    than attempted, so a client only needs to retry the failed ones.
+    """
+    results = []
+    chunk = []
+    index = 0
+    error = None
+
+    async def write(chunk):
+        nonlocal error
+        if error is not None:
+            results.extend({"index": i, "status": "error", "error": f"not written: an earlier chunk failed: {error}"}
+                           for i, _ in chunk)
+            return
+        statuses, error = await _write_review_chunk(chunk, session)
+        results.extend(statuses)
+
+    async with causal_session() as session:
+        try:
+            async for raw in _iter_bulk_body(request):
+                if isinstance(raw, bytes):
+                    try:
+                        raw = orjson.loads(raw)
+                    except orjson.JSONDecodeError as e:
+                        results.append({"index": index, "status": "error", "error": f"Invalid JSON: {e}"})
+                        index += 1
+                        continue
+                chunk.append((index, raw))
+                index += 1
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    await write(chunk)
+                    chunk = []
+        except HTTPException:
+            # Malformed JSON array: raised before anything is written
+            raise
+        except Exception as e:
+            # Body stream broke off: report what was written, and the buffered items as not written
+            error = error or f"request body could not be read: {e}"
+        if chunk:
+            await write(chunk)
+        if error is not None:
+            ERRORS.inc("bulk_reviews")
+            print(f"Error in bulk review ingestion: {error}")
+        token = encode_token(session)
+
+    if token:
+        response.headers[CAUSAL_TOKEN_HEADER] = token
+    results.sort(key=lambda r: r["index"])
+    inserted = sum(1 for r in results if r["status"] == "ok")
+    return {"inserted": inserted, "failed": len(results) - inserted, "items": results}
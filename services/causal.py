@@ -0,0 +1,67 @@
+import base64
+import os
+from contextlib import asynccontextmanager
+
+import bson
+import pymongo
+from fastapi import HTTPException
+from pymongo.errors import PyMongoError
+
+from database import async_client, async_db_causal_read, async_db_primary_read
+from services.metrics import Counter
+
+# Writes return this header; reads that send it back see at least that write
+CAUSAL_TOKEN_HEADER = "X-Causal-Token"
+# How long a causal read waits for a secondary to catch up before using the primary
+CAUSAL_READ_TIMEOUT = float(os.environ.get("CAUSAL_READ_TIMEOUT_MS", "500")) / 1000
+
+CAUSAL_READS = Counter("causal_reads_total", "Reads made after a client's causal token.", ("served_by",))
+
+
+def encode_token(session):
+    """Opaque token for the session's operationTime/clusterTime, or None (standalone mongod)."""
+    if session.operation_time is None:
+        return None
+    raw = bson.encode({"operation_time": session.operation_time, "cluster_time": session.cluster_time})
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        fields = bson.decode(base64.urlsafe_b64decode(padded))
+        return fields["operation_time"], fields.get("cluster_time")
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Invalid {CAUSAL_TOKEN_HEADER}")
+
+
+@asynccontextmanager
+async def causal_session(token=None):
+    """Causally consistent session on the main cluster, advanced to the token's time if given."""
+    async with async_client.start_session(causal_consistency=True) as session:
+        if token:
+            operation_time, cluster_time = decode_token(token)
+            if cluster_time:
+                session.advance_cluster_time(cluster_time)
+            session.advance_operation_time(operation_time)
+        yield session
+
+
+async def read_after(token, read):
+    """
+    Run read(db, session) so it observes every write up to the token.
+    Stays on secondaries (afterClusterTime makes one wait until it has
+    replicated the write); falls back to the primary if none catches up
+    within CAUSAL_READ_TIMEOUT.
+    """
+    async with causal_session(token) as session:
+        try:
+            with pymongo.timeout(CAUSAL_READ_TIMEOUT):
+                result = await read(async_db_causal_read, session)
+            CAUSAL_READS.inc("secondary_preferred")
+            return result
+        except PyMongoError as e:
+            if not e.timeout:
+                raise
+        CAUSAL_READS.inc("primary")
+        return await read(async_db_primary_read, session)
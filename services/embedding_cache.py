@@ -0,0 +1,204 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from services.embeddings import get_provider
+from services.metrics import ERRORS, register_cache
+
+# Optional shared tier so several uvicorn workers reuse each other's embeddings
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = float(os.environ.get("EMBEDDING_CACHE_TTL", "86400"))
+# Disk tier bounds: rows over the cap (oldest first) and expired rows are
+# deleted by whichever process writes first after each prune interval
+EMBEDDING_CACHE_DISK_SIZE = int(os.environ.get("EMBEDDING_CACHE_DISK_SIZE", "200000"))
+EMBEDDING_CACHE_PRUNE_INTERVAL = float(os.environ.get("EMBEDDING_CACHE_PRUNE_INTERVAL", "60"))
+
+
+def normalize_query(text):
+    return " ".join(text.lower().split())
+
+
+class _DiskTier:
+    """SQLite-backed store shared between processes on the same host."""
+
+    def __init__(self, path, ttl_seconds, max_rows=EMBEDDING_CACHE_DISK_SIZE,
+                 prune_interval=EMBEDDING_CACHE_PRUNE_INTERVAL):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._prune_lock = threading.Lock()
+        self._last_prune = 0.0
+        self.pruned = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT vector, created FROM embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector
+
+    def put(self, key, vector):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+            (key, vector.tobytes(), time.time())
+        )
+        conn.commit()
+        self._maybe_prune(conn)
+
+    def _maybe_prune(self, conn):
+        now = time.monotonic()
+        with self._prune_lock:
+            if now - self._last_prune < self.prune_interval:
+                return
+            self._last_prune = now
+        expired = conn.execute(
+            "DELETE FROM embeddings WHERE created < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        # Rows past the newest max_rows, oldest first
+        over = conn.execute(
+            "DELETE FROM embeddings WHERE created <= ("
+            " SELECT created FROM embeddings ORDER BY created DESC LIMIT 1 OFFSET ?)",
+            (self.max_rows,)
+        ).rowcount
+        conn.commit()
+        self.pruned += expired + over
+
+
+class EmbeddingCache:
+    """
+    LRU + TTL cache of query embeddings keyed by (model, normalized text).
+    Vectors are kept as float32 arrays (4 bytes/dim instead of a list of
+    Python floats).
+    """
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, ttl_seconds=EMBEDDING_CACHE_TTL,
+                 disk_path=EMBEDDING_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskTier(disk_path, ttl_seconds) if disk_path else None
+        self.disk_enabled = self._disk is not None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, text, model):
+        return f"{model}\x00{normalize_query(text)}"
+
+    def get(self, text, model):
+        key = self._key(text, model)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+        if self._disk is not None:
+            try:
+                vector = self._disk.get(key)
+            except sqlite3.Error as e:
+                ERRORS.inc("embedding_disk_cache")
+                print(f"Embedding disk cache read failed: {e}")
+                vector = None
+            if vector is not None:
+                self._put_memory(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text, vector, model):
+        key = self._key(text, model)
+        vector = array("f", vector)
+        self._put_memory(key, vector)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, vector)
+            except sqlite3.Error as e:
+                ERRORS.inc("embedding_disk_cache")
+                print(f"Embedding disk cache write failed: {e}")
+        return vector
+
+    def _put_memory(self, key, vector):
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_tier": self.disk_enabled,
+                "disk_pruned": self._disk.pruned if self._disk is not None else 0,
+            }
+
+
+embedding_cache = EmbeddingCache()
+register_cache("embedding", embedding_cache)
+
+
+async def aembed_query(text):
+    """
+    Embedding for a search query, served from the cache when possible.
+    The SQLite tier is consulted off the event loop.
+    """
+    provider = get_provider()
+    if embedding_cache.disk_enabled:
+        vector = await asyncio.to_thread(embedding_cache.get, text, provider.name)
+    else:
+        vector = embedding_cache.get(text, provider.name)
+    if vector is None:
+        embedded = (await provider.aembed([text]))[0]
+        if embedding_cache.disk_enabled:
+            vector = await asyncio.to_thread(embedding_cache.put, text, embedded, provider.name)
+        else:
+            vector = embedding_cache.put(text, embedded, provider.name)
+    return vector.tolist()
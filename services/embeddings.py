@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+
+# "ollama" (HTTP to the Ollama server), "local" (in-process sentence-transformers)
+# or "fake" (deterministic hashed bag-of-words, for benchmarks without a model)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "ollama")
+OLLAMA_MODEL = os.environ.get("OLLAMA_EMBEDDING_MODEL", "all-minilm")
+LOCAL_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# sentence-transformers backend: "torch" or "onnx"
+LOCAL_MODEL_BACKEND = os.environ.get("LOCAL_EMBEDDING_BACKEND", "torch")
+LOCAL_MAX_BATCH = int(os.environ.get("LOCAL_EMBEDDING_MAX_BATCH", "128"))
+LOCAL_MAX_WAIT_MS = float(os.environ.get("LOCAL_EMBEDDING_MAX_WAIT_MS", "5"))
+
+
+class EmbeddingProvider(ABC):
+    """
+    Turns texts into vectors. `name` identifies the model so caches never mix
+    vectors from different backends.
+    """
+    name = None
+
+    @abstractmethod
+    def embed(self, texts):
+        """One vector per text, in order."""
+
+    async def aembed(self, texts):
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class OllamaProvider(EmbeddingProvider):
+    def __init__(self, model=OLLAMA_MODEL):
+        import ollama
+        self.model = model
+        self.name = f"ollama:{model}"
+        self._client = ollama.Client()
+        self._async_client = ollama.AsyncClient()
+
+    def embed(self, texts):
+        return self._client.embed(model=self.model, input=list(texts))['embeddings']
+
+    async def aembed(self, texts):
+        response = await self._async_client.embed(model=self.model, input=list(texts))
+        return response['embeddings']
+
+
+class LocalProvider(EmbeddingProvider):
+    """
+    In-process all-MiniLM-L6-v2 (the model Ollama serves as all-minilm).
+    Calls from any thread or coroutine are queued and coalesced by one
+    batcher thread into a single encode() of up to max_batch texts, waiting
+    at most max_wait_ms for more callers; the model itself uses all cores.
+    """
+
+    def __init__(self, model=LOCAL_MODEL, backend=LOCAL_MODEL_BACKEND,
+                 max_batch=LOCAL_MAX_BATCH, max_wait_ms=LOCAL_MAX_WAIT_MS):
+        # Avoid tokenizer thread pools fighting the batcher thread
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        from sentence_transformers import SentenceTransformer
+        self.name = f"local:{model}"
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._model = SentenceTransformer(model, device="cpu", backend=backend)
+        self._requests = queue.Queue()
+        self._batcher = threading.Thread(target=self._run_batcher, name="embedding-batcher", daemon=True)
+        self._batcher.start()
+
+    def _submit(self, texts):
+        future = Future()
+        self._requests.put((list(texts), future))
+        return future
+
+    def embed(self, texts):
+        return self._submit(texts).result()
+
+    async def aembed(self, texts):
+        return await asyncio.wrap_future(self._submit(texts))
+
+    def _run_batcher(self):
+        while True:
+            requests = [self._requests.get()]
+            size = len(requests[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                vectors = self._model.encode(
+                    texts, batch_size=self.max_batch, convert_to_numpy=True, normalize_embeddings=True
+                ).tolist()
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_texts, future in requests:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+class FakeProvider(EmbeddingProvider):
+    """
+    Deterministic stand-in: each word is hashed into one of `dimensions`
+    buckets and the counts are L2-normalized, so texts sharing words are
+    close. Same dimensionality as all-minilm; no model, no network.
+    """
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+        self.name = f"fake:hash-{dimensions}"
+
+    def embed_one(self, text):
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts):
+        return [self.embed_one(text) for text in texts]
+
+    async def aembed(self, texts):
+        return self.embed(texts)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """Process-wide embedding provider selected by EMBEDDING_BACKEND."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                if EMBEDDING_BACKEND == "local":
+                    _provider = LocalProvider()
+                elif EMBEDDING_BACKEND == "ollama":
+                    _provider = OllamaProvider()
+                elif EMBEDDING_BACKEND == "fake":
+                    _provider = FakeProvider()
+                else:
+                    raise ValueError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+    return _provider
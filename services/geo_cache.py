@@ -0,0 +1,314 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.metrics import register_cache
+
+# Radius used by MongoDB for 2dsphere distances, in meters
+EARTH_RADIUS_M = 6378100.0
+
+# Requested radii are rounded up to one of these, so nearby requests share entries
+RADIUS_BUCKETS_M = [500, 1000, 2000, 5000, 10000, 25000, 50000]
+
+GEO_CACHE_SIZE = int(os.environ.get("GEO_CACHE_SIZE", "2000"))
+GEO_CACHE_TTL = float(os.environ.get("GEO_CACHE_TTL", "60"))
+# Upper bound on documents pulled per scatter-gather
+GEO_CACHE_FETCH_LIMIT = int(os.environ.get("GEO_CACHE_FETCH_LIMIT", "5000"))
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geohash_encode(lon, lat, precision):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                value = (value << 1) | 1
+                lon_lo = mid
+            else:
+                value <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_bounds(cell):
+    """(lon_lo, lat_lo, lon_hi, lat_hi) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for ch in cell:
+        value = _BASE32.index(ch)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lon_lo, lat_lo, lon_hi, lat_hi
+
+
+def radius_bucket(radius_meters):
+    for bucket in RADIUS_BUCKETS_M:
+        if radius_meters <= bucket:
+            return bucket
+    return None
+
+
+def precision_for(bucket):
+    # Coarsest geohash whose half-diagonal (at the equator) is <= bucket / 4,
+    # so the covering query is at most ~25% wider than the requested radius
+    for precision in range(1, 10):
+        lon_bits = (5 * precision + 1) // 2
+        lat_bits = (5 * precision) // 2
+        width = 360.0 / (1 << lon_bits) * math.pi / 180 * EARTH_RADIUS_M
+        height = 180.0 / (1 << lat_bits) * math.pi / 180 * EARTH_RADIUS_M
+        if math.hypot(width, height) / 2 <= bucket / 4:
+            return precision
+    return 9
+
+
+def _is_exclusion(projection):
+    return all(not v for k, v in projection.items() if k != "_id")
+
+
+def _fetch_projection(projection):
+    # Entries always need 'location' to re-rank by exact distance
+    if projection is None:
+        return None
+    if _is_exclusion(projection):
+        return {k: v for k, v in projection.items() if k != "location"}
+    return dict(projection, location=1)
+
+
+def _returns_location(projection):
+    if projection is None:
+        return True
+    if _is_exclusion(projection):
+        return projection.get("location", 1) != 0
+    return bool(projection.get("location"))
+
+
+class _Entry:
+    def __init__(self, docs, center, coverage_m, expires, bbox):
+        self.docs = docs
+        self.center = center
+        # Radius around `center` inside which `docs` is the complete result set
+        self.coverage_m = coverage_m
+        self.expires = expires
+        self.bbox = bbox
+
+
+class GeoCellCache:
+    """
+    Caches $near scatter-gather results per (geohash cell, radius bucket).
+    A miss fetches every business within bucket + cell half-diagonal of the
+    cell center, which covers any query point in the cell; hits are then
+    re-filtered and re-sorted by exact distance from the caller's point.
+    Returned documents are shared with the cache and must not be mutated.
+    """
+
+    def __init__(self, max_entries=GEO_CACHE_SIZE, ttl_seconds=GEO_CACHE_TTL,
+                 fetch_limit=GEO_CACHE_FETCH_LIMIT):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fetch_limit = fetch_limit
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.invalidations = 0
+
+    def _get_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put_entry(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _fetch(self, collection, key, cell, bucket, projection):
+        lon_lo, lat_lo, lon_hi, lat_hi = geohash_bounds(cell)
+        center = ((lon_lo + lon_hi) / 2, (lat_lo + lat_hi) / 2)
+        half_diag = max(
+            haversine_m(center[0], center[1], lon, lat)
+            for lon in (lon_lo, lon_hi) for lat in (lat_lo, lat_hi)
+        )
+        covering = bucket + half_diag
+        query = {
+            "location": {
+                "$near": {
+                    "$geometry": {"type": "Point", "coordinates": list(center)},
+                    "$maxDistance": covering
+                }
+            }
+        }
+        docs = await collection.find(query, _fetch_projection(projection)).limit(self.fetch_limit).to_list()
+        coverage = covering
+        if len(docs) >= self.fetch_limit:
+            # Truncated: only complete up to the farthest document returned
+            last = docs[-1]["location"]["coordinates"]
+            coverage = haversine_m(center[0], center[1], last[0], last[1])
+        # Pad the bbox by the coverage radius for cheap invalidation checks
+        dlat = math.degrees(coverage / EARTH_RADIUS_M)
+        dlon = dlat / max(math.cos(math.radians(center[1])), 1e-6)
+        bbox = (center[0] - dlon, center[1] - dlat, center[0] + dlon, center[1] + dlat)
+        entry = _Entry(docs, center, coverage, time.monotonic() + self.ttl_seconds, bbox)
+        self._put_entry(key, entry)
+        return entry
+
+    async def _entry_for(self, collection, key, cell, bucket, projection):
+        entry = self._get_entry(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+        # Coalesce concurrent misses for the same cell into one scatter-gather
+        task = self._inflight.get(key)
+        if task is None:
+            with self._lock:
+                self.misses += 1
+            task = asyncio.ensure_future(self._fetch(collection, key, cell, bucket, projection))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def find_near(self, collection, lon, lat, radius_meters, limit=None, projection=None):
+        """
+        Businesses within radius_meters of (lon, lat), nearest first,
+        equivalent to a `$near` query with `$maxDistance` and `limit`.
+        """
+        bucket = radius_bucket(radius_meters)
+        if bucket is None:
+            with self._lock:
+                self.bypasses += 1
+            return await self._direct(collection, lon, lat, radius_meters, limit, projection)
+
+        precision = precision_for(bucket)
+        cell = geohash_encode(lon, lat, precision)
+        proj_key = tuple(sorted(projection.items())) if projection is not None else None
+        key = (collection.full_name, proj_key, bucket, cell)
+        entry = await self._entry_for(collection, key, cell, bucket, projection)
+
+        offset = haversine_m(lon, lat, entry.center[0], entry.center[1])
+        exact_within = entry.coverage_m - offset
+        ranked = []
+        for doc in entry.docs:
+            coords = doc["location"]["coordinates"]
+            distance = haversine_m(lon, lat, coords[0], coords[1])
+            if distance <= radius_meters:
+                ranked.append((distance, doc))
+        ranked.sort(key=lambda pair: pair[0])
+
+        if radius_meters > exact_within:
+            # Truncated entry: only results nearer than exact_within are trustworthy
+            trusted = [pair for pair in ranked if pair[0] <= exact_within]
+            if limit is None or len(trusted) < limit:
+                with self._lock:
+                    self.bypasses += 1
+                return await self._direct(collection, lon, lat, radius_meters, limit, projection)
+            ranked = trusted
+
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self._strip(doc, projection) for _, doc in ranked]
+
+    def _strip(self, doc, projection):
+        if not _returns_location(projection):
+            doc = {k: v for k, v in doc.items() if k != "location"}
+        return doc
+
+    async def _direct(self, collection, lon, lat, radius_meters, limit, projection):
+        query = {
+            "location": {
+                "$near": {
+                    "$geometry": {"type": "Point", "coordinates": [lon, lat]},
+                    "$maxDistance": radius_meters
+                }
+            }
+        }
+        cursor = collection.find(query, projection)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list()
+
+    def invalidate_point(self, lon, lat):
+        """Drop every entry whose covered area contains (lon, lat)."""
+        with self._lock:
+            stale = []
+            for key, entry in self._entries.items():
+                lon_lo, lat_lo, lon_hi, lat_hi = entry.bbox
+                if not (lon_lo <= lon <= lon_hi and lat_lo <= lat <= lat_hi):
+                    continue
+                if haversine_m(lon, lat, entry.center[0], entry.center[1]) <= entry.coverage_m:
+                    stale.append(key)
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "invalidations": self.invalidations,
+            }
+
+
+geo_cache = GeoCellCache()
+register_cache("geo", geo_cache)
@@ -0,0 +1,232 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pymongo import monitoring
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; request stages and Mongo commands are mostly in the 1 ms - 1 s range
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help_text, labelnames=(), function=None):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        # Read at scrape time: the value, or {labels: value} for a labelled metric
+        self.function = function
+        _registry.append(self)
+
+    def render(self):
+        if self.function is not None:
+            values = self.function()
+            with self._lock:
+                self._values = dict(values) if self.labelnames else {(): values}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket (non-cumulative) counts + the +Inf bucket, sum
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render():
+    """All metrics of this process in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency.", ("method", "route", "status"))
+STAGE_SECONDS = Histogram(
+    "request_stage_duration_seconds", "Time spent in each stage of a request.", ("route", "stage"))
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trips.", ("command", "collection"))
+MONGO_DOCUMENTS_RETURNED = Counter(
+    "mongodb_documents_returned_total", "Documents returned in cursor batches.", ("command", "collection"))
+MONGO_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that failed.", ("command", "collection"))
+ERRORS = Counter("app_errors_total", "Errors handled (and printed) by component.", ("component",))
+
+# In-process caches by name; each keeps its own counters, read from stats() at scrape time
+_caches = {}
+
+
+def register_cache(name, cache):
+    """Export cache.stats() counters under the cache="<name>" label."""
+    _caches[name] = cache
+
+
+def _cache_stat(key):
+    def read():
+        values = {}
+        for name, cache in list(_caches.items()):
+            stats = cache.stats()
+            if key in stats:
+                values[(name,)] = stats[key]
+        return values
+    return read
+
+
+CACHE_HITS = Counter("cache_hits_total", "Cache lookups served from memory.", ("cache",),
+                     function=_cache_stat("hits"))
+CACHE_DISK_HITS = Counter("cache_disk_hits_total", "Cache lookups served from the shared disk tier.", ("cache",),
+                          function=_cache_stat("disk_hits"))
+CACHE_MISSES = Counter("cache_misses_total", "Cache lookups that went to the backing store.", ("cache",),
+                       function=_cache_stat("misses"))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries evicted to stay under the size limit.", ("cache",),
+                          function=_cache_stat("evictions"))
+CACHE_INVALIDATIONS = Counter("cache_invalidations_total", "Entries dropped after a write.", ("cache",),
+                              function=_cache_stat("invalidations"))
+CACHE_ENTRIES = Gauge("cache_entries", "Entries currently cached.", ("cache",),
+                      function=_cache_stat("entries"))
+
+
+class StageTimer:
+    """
+    Times consecutive stages of one request: each mark() records the time
+    since the previous mark under STAGE_SECONDS{route, stage}.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.timings = {}
+        self._started = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        STAGE_SECONDS.observe(elapsed, self.route, stage)
+        self.timings[stage] = round(elapsed * 1000, 2)
+
+    def total_ms(self):
+        return round((time.perf_counter() - self._started) * 1000, 2)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Per-command latency and documents returned, by collection. Passed as an
+    event listener to every MongoClient in database.py.
+    """
+
+    def __init__(self):
+        # (connection, request_id) -> (command, collection), between started and finished
+        self._inflight = {}
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection", "")
+        else:
+            collection = command.get(event.command_name)
+            if not isinstance(collection, str):
+                collection = ""
+        self._inflight[(event.connection_id, event.request_id)] = (event.command_name, collection)
+
+    def succeeded(self, event):
+        labels = self._inflight.pop((event.connection_id, event.request_id), (event.command_name, ""))
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, *labels)
+        cursor = event.reply.get("cursor") if hasattr(event.reply, "get") else None
+        if cursor:
+            returned = len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+            if returned:
+                MONGO_DOCUMENTS_RETURNED.inc(*labels, amount=returned)
+
+    def failed(self, event):
+        labels = self._inflight.pop((event.connection_id, event.request_id), (event.command_name, ""))
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, *labels)
+        MONGO_COMMAND_FAILURES.inc(*labels)
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port):
+    """Serve /metrics from a daemon thread, for processes without the API (sync worker)."""
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import sys
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.metrics import ERRORS
+
+# "inline": each review updates its business immediately (single-document atomic update).
+# "batched": deltas are merged in memory and flushed with one bulk_write every interval.
+AGGREGATE_MODE = os.environ.get("AGGREGATE_MODE", "inline")
+AGGREGATE_FLUSH_INTERVAL = float(os.environ.get("AGGREGATE_FLUSH_INTERVAL", "1.0"))
+
+STAR_BUCKETS = ["1", "2", "3", "4", "5"]
+
+
+def star_bucket(stars):
+    return str(min(5, max(1, int(round(stars)))))
+
+
+class RatingDelta:
+    """Change to a business's rating aggregates from one or more reviews."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_stars = 0.0
+        self.histogram = {}
+        self.last_updated = None
+
+    @classmethod
+    def for_review(cls, stars, date=None):
+        delta = cls()
+        delta.add(stars, date)
+        return delta
+
+    def add(self, stars, date=None):
+        self.count += 1
+        self.total_stars += stars
+        bucket = star_bucket(stars)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        if date is not None and (self.last_updated is None or date > self.last_updated):
+            self.last_updated = date
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_stars += other.total_stars
+        for bucket, n in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + n
+        if other.last_updated is not None and (self.last_updated is None or other.last_updated > self.last_updated):
+            self.last_updated = other.last_updated
+
+    def negated(self):
+        delta = RatingDelta()
+        delta.count = -self.count
+        delta.total_stars = -self.total_stars
+        delta.histogram = {bucket: -n for bucket, n in self.histogram.items()}
+        return delta
+
+    def pipeline(self):
+        """
+        Update pipeline applying this delta atomically to one business document.
+        Businesses loaded from the Yelp dataset have no total_stars yet, so it is
+        seeded from stars * review_count (run `recompute` for exact values).
+        """
+        increments = {
+            "review_count": {"$add": [{"$ifNull": ["$review_count", 0]}, self.count]},
+            "total_stars": {"$add": [
+                {"$ifNull": ["$total_stars", {"$multiply": [
+                    {"$ifNull": ["$stars", 0]}, {"$ifNull": ["$review_count", 0]}
+                ]}]},
+                self.total_stars
+            ]},
+        }
+        for bucket, n in self.histogram.items():
+            increments[f"star_histogram.{bucket}"] = {"$add": [{"$ifNull": [f"$star_histogram.{bucket}", 0]}, n]}
+        if self.last_updated is not None:
+            increments["last_updated"] = {"$max": [{"$ifNull": ["$last_updated", ""]}, self.last_updated]}
+        return [
+            {"$set": increments},
+            {"$set": {
+                "average_stars": {"$cond": [
+                    {"$gt": ["$review_count", 0]},
+                    {"$divide": ["$total_stars", "$review_count"]},
+                    0
+                ]}
+            }},
+            # Displayed rating, rounded to the half star like the Yelp dataset
+            {"$set": {"stars": {"$divide": [{"$round": [{"$multiply": ["$average_stars", 2]}, 0]}, 2]}}}
+        ]
+
+
+def aggregate_updates(deltas):
+    """UpdateOne per business for a {business_id: RatingDelta} map."""
+    return [
+        UpdateOne({"business_id": business_id}, delta.pipeline())
+        for business_id, delta in deltas.items()
+        if delta.count
+    ]
+
+
+class AggregateBuffer:
+    """
+    Batched aggregation mode: merges per-business deltas in memory and applies
+    them with one unordered bulk_write per flush interval. Inline mode uses it
+    to retry updates whose bulk_write failed. Deltas not yet flushed are lost
+    if the process dies; `recompute` repairs them from the reviews.
+    """
+
+    def __init__(self, collection, interval=AGGREGATE_FLUSH_INTERVAL):
+        self.collection = collection
+        self.interval = interval
+        self._pending = {}
+        self._task = None
+
+    def add(self, business_id, delta):
+        pending = self._pending.get(business_id)
+        if pending is None:
+            self._pending[business_id] = delta
+        else:
+            pending.merge(delta)
+
+    def requeue(self, items, error):
+        """Queue [(business_id, delta)] whose bulk_write raised error for the next flush."""
+        if isinstance(error, BulkWriteError):
+            # Unordered: only the reported updates failed
+            items = [items[err["index"]] for err in error.details.get("writeErrors", [])]
+        ERRORS.inc("rating_aggregates")
+        print(f"Error applying rating aggregates for {len(items)} businesses: {error}")
+        for business_id, delta in items:
+            self.add(business_id, delta)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        deltas, self._pending = self._pending, {}
+        items = [(business_id, delta) for business_id, delta in deltas.items() if delta.count]
+        try:
+            await self.collection.bulk_write(aggregate_updates(dict(items)), ordered=False)
+        except Exception as e:
+            self.requeue(items, e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def recompute(db, batch_size=1000):
+    """Rebuild every business's aggregates from its reviews."""
+    stages = [
+        {"$group": {
+            "_id": {"business_id": "$business_id", "bucket": {"$max": [1, {"$min": [5, {"$toInt": {"$round": ["$stars", 0]}}]}]}},
+            "count": {"$sum": 1},
+            "total": {"$sum": "$stars"},
+        }},
+        {"$group": {
+            "_id": "$_id.business_id",
+            "review_count": {"$sum": "$count"},
+            "total_stars": {"$sum": "$total"},
+            "histogram": {"$push": {"k": "$_id.bucket", "v": "$count"}},
+        }},
+    ]
+    updates = []
+    updated = 0
+    for row in db.reviews.aggregate(stages, allowDiskUse=True):
+        average = row["total_stars"] / row["review_count"]
+        histogram = {bucket: 0 for bucket in STAR_BUCKETS}
+        for entry in row["histogram"]:
+            histogram[str(entry["k"])] = entry["v"]
+        updates.append(UpdateOne({"business_id": row["_id"]}, {"$set": {
+            "review_count": row["review_count"],
+            "total_stars": row["total_stars"],
+            "star_histogram": histogram,
+            "average_stars": average,
+            "stars": round(average * 2) / 2,
+        }}))
+        if len(updates) >= batch_size:
+            db.businesses.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+            print(f"Recomputed {updated} businesses...", end='\r')
+    if updates:
+        db.businesses.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    print(f"\nRecomputed aggregates for {updated} businesses.")
+
+
+if __name__ == "__main__":
+    if "recompute" in sys.argv:
+        mongo_client = MongoClient("mongodb://localhost:27017")
+        try:
+            recompute(mongo_client.yelp_data)
+        finally:
+            mongo_client.close()
+    else:
+        print("Usage: python -m services.rating_aggregates recompute")
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from services.metrics import ERRORS, register_cache
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "30"))
+
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class CachedResponse:
+    def __init__(self, body, headers, expires):
+        self.body = body
+        self.etag = make_etag(body)
+        self.headers = headers
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized response bodies for hot businesses,
+    keyed per business so one invalidate() drops everything about it.
+    Bodies are stored already encoded with their ETag, so a hit costs neither
+    a Mongo round trip nor re-serialization. Concurrent misses share one load.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # Bumped on invalidate so a load that started before it is not stored
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, business_id, kind, loader):
+        """
+        loader() -> (body bytes, headers dict). Returns a CachedResponse.
+        """
+        key = (business_id, kind)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        # Keyed by generation too: a miss after invalidate() must not join a
+        # load that started before it and may return the old data
+        generation = self._generations.get(business_id, 0)
+        task = self._inflight.get((business_id, kind, generation))
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader, generation))
+            self._inflight[(business_id, kind, generation)] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, generation):
+        try:
+            body, headers = await loader()
+        finally:
+            self._inflight.pop((*key, generation), None)
+        entry = CachedResponse(body, headers, time.monotonic() + self.ttl_seconds)
+        if self._generations.get(key[0], 0) == generation:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, business_id):
+        self._generations[business_id] = self._generations.get(business_id, 0) + 1
+        for key in [k for k in self._entries if k[0] == business_id]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def invalidate_all(self):
+        """Invalidate every business with a cached or in-flight response."""
+        for business_id in {k[0] for k in self._entries} | {k[0] for k in self._inflight}:
+            self.invalidate(business_id)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+response_cache = ResponseCache()
+register_cache("response", response_cache)
+
+
+async def watch_invalidations(db):
+    """
+    Drop cached responses for businesses whose reviews or document changed,
+    including writes made through other API workers. Runs until cancelled.
+    """
+    pipeline = [
+        {"$match": {
+            "$or": [
+                {"ns.coll": "reviews", "operationType": "insert"},
+                {"ns.coll": "businesses", "operationType": {"$in": ["update", "replace", "delete"]}},
+            ]
+        }},
+        {"$project": {"ns": 1, "operationType": 1, "documentKey": 1, "fullDocument.business_id": 1,
+                      "fullDocumentBeforeChange.business_id": 1}}
+    ]
+    while True:
+        try:
+            # Pre-images (if enabled on businesses) name the business a delete removed
+            async with await db.watch(pipeline, full_document="updateLookup",
+                                      full_document_before_change="whenAvailable") as stream:
+                async for change in stream:
+                    if change["operationType"] == "delete":
+                        # documentKey carries business_id when it is part of the shard key
+                        business_id = ((change.get("fullDocumentBeforeChange") or {}).get("business_id")
+                                       or change["documentKey"].get("business_id"))
+                        if business_id is None:
+                            # Deletes are rare; drop everything rather than serve a deleted business
+                            response_cache.invalidate_all()
+                            continue
+                    else:
+                        business_id = (change.get("fullDocument") or {}).get("business_id")
+                    if business_id is not None:
+                        response_cache.invalidate(business_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ERRORS.inc("response_cache_watch")
+            print(f"Error in response cache invalidation stream: {e}")
+            # Anything missed meanwhile expires via the TTL
+            await asyncio.sleep(5)
@@ -0,0 +1,267 @@
+import argparse
+import os
+import time
+
+from weaviate.classes.config import (
+    Configure, DataType, Property, Reconfigure, Tokenization, VectorDistances
+)
+from weaviate.classes.data import DataObject, GeoCoordinate
+from weaviate.util import generate_uuid5
+
+# Every writer and reader of review vectors goes through this name; point it at
+# a migrated collection (see `migrate` below) to switch over
+REVIEW_COLLECTION = os.environ.get("WEAVIATE_REVIEW_COLLECTION", "Review")
+
+# "pq": product quantization, ~1 byte per segment in memory (default); enabled
+#       by apply_tuning once vectors are loaded, not at creation (see quantizer_config)
+# "bq": binary quantization, 1 bit per dimension; only settable at creation
+# "none": full float32 vectors in memory
+REVIEW_VECTOR_COMPRESSION = os.environ.get("REVIEW_VECTOR_COMPRESSION", "pq")
+# all-minilm / all-MiniLM-L6-v2
+EMBEDDING_DIMENSIONS = 384
+PQ_SEGMENTS = int(os.environ.get("REVIEW_PQ_SEGMENTS", "96"))
+PQ_TRAINING_LIMIT = int(os.environ.get("REVIEW_PQ_TRAINING_LIMIT", "100000"))
+# Build-time HNSW parameters; fixed once the collection exists
+HNSW_EF_CONSTRUCTION = int(os.environ.get("REVIEW_HNSW_EF_CONSTRUCTION", "128"))
+HNSW_MAX_CONNECTIONS = int(os.environ.get("REVIEW_HNSW_MAX_CONNECTIONS", "32"))
+# Query-time search list size; -1 lets Weaviate scale it with the limit
+# between the dynamic bounds (semantic search asks for 200 candidates)
+HNSW_EF = int(os.environ.get("REVIEW_HNSW_EF", "-1"))
+HNSW_DYNAMIC_EF_MIN = int(os.environ.get("REVIEW_HNSW_DYNAMIC_EF_MIN", "100"))
+HNSW_DYNAMIC_EF_MAX = int(os.environ.get("REVIEW_HNSW_DYNAMIC_EF_MAX", "500"))
+HNSW_DYNAMIC_EF_FACTOR = int(os.environ.get("REVIEW_HNSW_DYNAMIC_EF_FACTOR", "8"))
+
+# Geo property used to filter semantic search by radius inside Weaviate
+LOCATION_PROPERTY = Property(name="location", data_type=DataType.GEO_COORDINATES)
+
+REVIEW_PROPERTIES = [
+    # IDs are matched exactly (containsAny on business_id), never searched;
+    # field tokenization keeps '-' and '_' in Yelp IDs from splitting them
+    Property(name="review_id", data_type=DataType.TEXT, tokenization=Tokenization.FIELD,
+             index_filterable=True, index_searchable=False),
+    Property(name="business_id", data_type=DataType.TEXT, tokenization=Tokenization.FIELD,
+             index_filterable=True, index_searchable=False),
+    # Only searched through BM25 (hybrid/keyword modes); no filterable index
+    Property(name="text", data_type=DataType.TEXT, tokenization=Tokenization.WORD,
+             index_filterable=False, index_searchable=True),
+    LOCATION_PROPERTY,
+]
+
+
+def quantizer_config(compression=REVIEW_VECTOR_COMPRESSION):
+    """
+    Quantizer for a new collection. PQ needs vectors to train its codebook, and
+    Weaviate only accepts it on an empty collection with ASYNC_INDEXING on, so
+    collections start uncompressed and apply_tuning enables PQ after loading.
+    """
+    if compression == "bq":
+        return Configure.VectorIndex.Quantizer.bq()
+    if compression in ("pq", "none"):
+        return None
+    raise ValueError(f"Unknown REVIEW_VECTOR_COMPRESSION: {compression}")
+
+
+def vector_index_config(compression=REVIEW_VECTOR_COMPRESSION, ef=HNSW_EF,
+                        ef_construction=HNSW_EF_CONSTRUCTION, max_connections=HNSW_MAX_CONNECTIONS):
+    return Configure.VectorIndex.hnsw(
+        distance_metric=VectorDistances.COSINE,
+        ef=ef,
+        dynamic_ef_min=HNSW_DYNAMIC_EF_MIN,
+        dynamic_ef_max=HNSW_DYNAMIC_EF_MAX,
+        dynamic_ef_factor=HNSW_DYNAMIC_EF_FACTOR,
+        ef_construction=ef_construction,
+        max_connections=max_connections,
+        quantizer=quantizer_config(compression)
+    )
+
+
+def create_review_collection(w_client, name=REVIEW_COLLECTION, **index_options):
+    """Create a review collection with the full schema; index_options go to vector_index_config."""
+    collection = w_client.collections.create(
+        name,
+        vectorizer_config=Configure.Vectorizer.none(),
+        vector_index_config=vector_index_config(**index_options),
+        properties=REVIEW_PROPERTIES
+    )
+    print(f"Created '{name}' collection in Weaviate.")
+    return collection
+
+
+def ensure_review_collection(w_client, name=REVIEW_COLLECTION):
+    """Create the Review collection, or add properties missing from an older one."""
+    if not w_client.collections.exists(name):
+        return create_review_collection(w_client, name)
+    collection = w_client.collections.get(name)
+    existing = {p.name for p in collection.config.get().properties}
+    for prop in REVIEW_PROPERTIES:
+        if prop.name not in existing:
+            collection.config.add_property(prop)
+            print(f"Added '{prop.name}' property to '{name}'.")
+    return collection
+
+
+def _quantizer_name(quantizer):
+    if quantizer is None:
+        return "none"
+    # _PQConfig / _BQConfig / _SQConfig
+    return type(quantizer).__name__.strip("_").removesuffix("Config").lower()
+
+
+def schema_drift(collection):
+    """
+    Differences between a collection and REVIEW_PROPERTIES / the configured
+    index that can only be fixed by migrating to a new collection.
+    """
+    config = collection.config.get()
+    drift = []
+    wanted = {p.name: p for p in REVIEW_PROPERTIES}
+    for prop in config.properties:
+        target = wanted.get(prop.name)
+        if target is None or target.dataType != prop.data_type:
+            continue
+        # Property (create) fields are camelCase; the config read back is snake_case
+        for option, wanted_option in (("index_filterable", "indexFilterable"), ("index_searchable", "indexSearchable")):
+            want = getattr(target, wanted_option)
+            if want is not None and want != getattr(prop, option):
+                drift.append(f"property '{prop.name}': {option} is {getattr(prop, option)}, want {want}")
+        if target.tokenization is not None and prop.tokenization != target.tokenization:
+            drift.append(f"property '{prop.name}': tokenization is {prop.tokenization}, want {target.tokenization}")
+    index = config.vector_index_config
+    if index.ef_construction != HNSW_EF_CONSTRUCTION:
+        drift.append(f"efConstruction is {index.ef_construction}, want {HNSW_EF_CONSTRUCTION}")
+    if index.max_connections != HNSW_MAX_CONNECTIONS:
+        drift.append(f"maxConnections is {index.max_connections}, want {HNSW_MAX_CONNECTIONS}")
+    current = _quantizer_name(index.quantizer)
+    if REVIEW_VECTOR_COMPRESSION == "bq" and current != "bq":
+        drift.append(f"compression is {current}, want bq")
+    return drift
+
+
+def apply_tuning(w_client, name=REVIEW_COLLECTION):
+    """
+    Apply the settings Weaviate can change in place: query-time ef and PQ.
+    Enabling PQ trains the codebook from the objects already stored.
+    """
+    collection = w_client.collections.get(name)
+    index = collection.config.get().vector_index_config
+    quantizer = None
+    if REVIEW_VECTOR_COMPRESSION == "pq" and _quantizer_name(index.quantizer) != "pq":
+        quantizer = Reconfigure.VectorIndex.Quantizer.pq(
+            enabled=True, segments=PQ_SEGMENTS, training_limit=PQ_TRAINING_LIMIT
+        )
+    collection.config.update(vector_index_config=Reconfigure.VectorIndex.hnsw(
+        ef=HNSW_EF,
+        dynamic_ef_min=HNSW_DYNAMIC_EF_MIN,
+        dynamic_ef_max=HNSW_DYNAMIC_EF_MAX,
+        dynamic_ef_factor=HNSW_DYNAMIC_EF_FACTOR,
+        quantizer=quantizer
+    ))
+    print(f"Updated '{name}': ef={HNSW_EF}" + (", PQ enabled" if quantizer else ""))
+    for line in schema_drift(collection):
+        print(f"Needs migration: {line}")
+    return collection
+
+
+def migrate_collection(w_client, source, target, batch_size=500):
+    """
+    Copy every object (same UUID, properties and vector) into a new collection
+    created with the current schema. Re-runnable: copies upsert by UUID.
+    Writers must be paused (or re-run afterwards) to not miss new reviews.
+    """
+    source_collection = w_client.collections.get(source)
+    if w_client.collections.exists(target):
+        target_collection = w_client.collections.get(target)
+    else:
+        target_collection = create_review_collection(w_client, target)
+
+    total = source_collection.aggregate.over_all(total_count=True).total_count
+    print(f"Copying {total} objects from '{source}' to '{target}'...")
+    copied = 0
+    batch = []
+    start_time = time.time()
+    for obj in source_collection.iterator(include_vector=True):
+        batch.append(DataObject(uuid=obj.uuid, properties=obj.properties, vector=obj.vector["default"]))
+        if len(batch) >= batch_size:
+            copied += _insert_batch(target_collection, batch)
+            batch = []
+            rate = copied / (time.time() - start_time)
+            print(f"Copied {copied}/{total} ({rate:.0f}/s)...", end='\r')
+    copied += _insert_batch(target_collection, batch)
+
+    # Verification
+    count = target_collection.aggregate.over_all(total_count=True).total_count
+    print(f"\nCopied {copied} objects; '{target}' has {count}, '{source}' had {total}.")
+    if count != total:
+        print(f"WARNING: {total - count:+d} difference between '{source}' and '{target}'")
+    else:
+        apply_tuning(w_client, target)
+        print(f"Set WEAVIATE_REVIEW_COLLECTION={target} for the API, sync worker and backfill "
+              f"to switch over, then delete '{source}'.")
+    return count
+
+
+def _insert_batch(collection, batch):
+    if not batch:
+        return 0
+    result = collection.data.insert_many(batch)
+    if result.errors:
+        raise RuntimeError(f"{len(result.errors)} objects failed to copy")
+    return len(batch)
+
+
+def to_geo_coordinate(location):
+    """GeoJSON Point ({"type": "Point", "coordinates": [lon, lat]}) -> GeoCoordinate."""
+    if not location or not location.get("coordinates"):
+        return None
+    lon, lat = location["coordinates"]
+    return GeoCoordinate(latitude=lat, longitude=lon)
+
+
+def review_uuid(review_id):
+    """
+    Weaviate object ID for a review, derived from its Mongo _id. Batch writes
+    with an existing ID overwrite the object, so every writer upserts.
+    """
+    return generate_uuid5(str(review_id))
+
+
+def review_properties(doc, location=None):
+    """Weaviate properties for a Mongo review document."""
+    properties = {
+        "review_id": str(doc["_id"]),
+        "business_id": doc["business_id"],
+        "text": doc.get("text", "")
+    }
+    geo = to_geo_coordinate(location or doc.get("location"))
+    if geo is not None:
+        properties["location"] = geo
+    return properties
+
+
+if __name__ == "__main__":
+    from services.weaviate_pool import connect
+
+    parser = argparse.ArgumentParser(description="Inspect, tune or migrate the Review collection.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="Show settings that differ from this schema")
+    sub.add_parser("apply", help="Apply in-place settings (ef, PQ)")
+    migrate = sub.add_parser("migrate", help="Copy into a new collection with the full schema")
+    migrate.add_argument("--source", default=REVIEW_COLLECTION)
+    migrate.add_argument("--target", required=True)
+    migrate.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    w_client = connect()
+    try:
+        if args.command == "check":
+            drift = schema_drift(w_client.collections.get(REVIEW_COLLECTION))
+            for line in drift:
+                print(f"Needs migration: {line}")
+            if not drift:
+                print(f"'{REVIEW_COLLECTION}' matches the schema.")
+        elif args.command == "apply":
+            apply_tuning(w_client)
+        else:
+            migrate_collection(w_client, args.source, args.target, args.batch_size)
+    finally:
+        w_client.close()
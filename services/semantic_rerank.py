@@ -0,0 +1,120 @@
+import os
+import numpy as np
+
+# Blend weights for the business-level score (relevance + quality + proximity)
+WEIGHT_RELEVANCE = float(os.environ.get("SEMANTIC_WEIGHT_RELEVANCE", "0.7"))
+WEIGHT_QUALITY = float(os.environ.get("SEMANTIC_WEIGHT_QUALITY", "0.2"))
+WEIGHT_PROXIMITY = float(os.environ.get("SEMANTIC_WEIGHT_PROXIMITY", "0.1"))
+# Bayesian prior for stars: a business with few reviews is pulled towards PRIOR_STARS
+PRIOR_STARS = float(os.environ.get("SEMANTIC_PRIOR_STARS", "3.5"))
+PRIOR_REVIEWS = float(os.environ.get("SEMANTIC_PRIOR_REVIEWS", "10"))
+# Matching review snippets returned per business
+SNIPPETS_PER_BUSINESS = 3
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lon, lat, lons, lats):
+    """Distances in meters from one point to arrays of points."""
+    lon1, lat1 = np.radians(lon), np.radians(lat)
+    lon2, lat2 = np.radians(lons), np.radians(lats)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def group_by_business(business_ids, relevance):
+    """
+    (unique business_ids, best relevance, matching review count) for candidate
+    reviews, in order of first appearance.
+    """
+    ids, first, inverse = np.unique(np.asarray(business_ids, dtype=object), return_index=True, return_inverse=True)
+    best = np.full(len(ids), -np.inf)
+    np.maximum.at(best, inverse, np.asarray(relevance, dtype=np.float64))
+    counts = np.bincount(inverse, minlength=len(ids))
+    order = np.argsort(first)
+    return ids[order].tolist(), best[order], counts[order]
+
+
+def score_businesses(best_relevance, stars, review_count, geo_m, radius_meters):
+    """
+    Blend per business, each term in [0, 1]:
+    - relevance: of the best matching review (see candidate_relevance)
+    - quality: stars shrunk towards PRIOR_STARS by review_count
+    - proximity: 1 at the search point, 0 at the radius edge
+    """
+    relevance = np.clip(best_relevance, 0.0, 1.0)
+    quality = (stars * review_count + PRIOR_STARS * PRIOR_REVIEWS) / (review_count + PRIOR_REVIEWS) / 5.0
+    proximity = 1.0 - np.clip(geo_m / max(radius_meters, 1), 0.0, 1.0)
+    return WEIGHT_RELEVANCE * relevance + WEIGHT_QUALITY * quality + WEIGHT_PROXIMITY * proximity
+
+
+def candidate_relevance(objects, search_type):
+    """
+    Relevance in [0, 1] for Weaviate result objects, higher is better:
+    - "vector": cosine similarity (1 - distance)
+    - "hybrid": relativeScoreFusion score, already in [0, 1]
+    - "keyword": BM25 score relative to the best hit
+    """
+    if search_type == "vector":
+        return [1.0 - obj.metadata.distance for obj in objects]
+    scores = [obj.metadata.score or 0.0 for obj in objects]
+    if search_type == "keyword":
+        top = max(scores, default=0.0)
+        return [score / top if top > 0 else 0.0 for score in scores]
+    return scores
+
+
+def rerank(candidates, business_map, lat, lon, radius_meters):
+    """
+    Group candidate reviews (dicts with business_id, text, relevance, best
+    match first) into business-level hits sorted by blended score.
+    """
+    # Reviews without a business_id can't become a business hit (and would break np.unique)
+    candidates = [c for c in candidates if c.get("business_id") is not None]
+    if not candidates:
+        return []
+    ids, best, counts = group_by_business(
+        [c["business_id"] for c in candidates], [c["relevance"] for c in candidates]
+    )
+
+    stars = np.zeros(len(ids))
+    review_count = np.zeros(len(ids))
+    lons = np.full(len(ids), lon)
+    lats = np.full(len(ids), lat)
+    located = np.zeros(len(ids), dtype=bool)
+    for i, business_id in enumerate(ids):
+        business = business_map.get(business_id) or {}
+        stars[i] = business.get("stars") or 0
+        review_count[i] = business.get("review_count") or 0
+        coordinates = (business.get("location") or {}).get("coordinates")
+        if coordinates:
+            lons[i], lats[i] = coordinates
+            located[i] = True
+    # Unknown location counts as the radius edge rather than the search point
+    geo_m = np.where(located, haversine_m(lon, lat, lons, lats), float(radius_meters))
+    scores = score_businesses(best, stars, review_count, geo_m, radius_meters)
+
+    snippets = {}
+    for c in candidates:
+        matches = snippets.setdefault(c["business_id"], [])
+        if len(matches) < SNIPPETS_PER_BUSINESS:
+            matches.append({"text": c["text"], "relevance": c["relevance"]})
+
+    hits = []
+    for i in np.argsort(-scores, kind="stable"):
+        business_id = ids[i]
+        business = business_map.get(business_id) or {}
+        hits.append({
+            "business_id": business_id,
+            "business_name": business.get("name"),
+            "business_city": business.get("city"),
+            "business_stars": business.get("stars"),
+            "business_review_count": business.get("review_count"),
+            "business_categories": business.get("categories"),
+            "distance_meters": round(float(geo_m[i]), 1),
+            "matching_reviews": snippets[business_id],
+            "match_count": int(counts[i]),
+            "best_relevance": float(best[i]),
+            "score": float(scores[i]),
+        })
+    return hits
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from services.metrics import ERRORS
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "100000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "600"))
+# Unknown user_ids are remembered for less time, in case they are created later
+USER_CACHE_NEGATIVE_TTL = float(os.environ.get("USER_CACHE_NEGATIVE_TTL", "60"))
+USER_LOOKUP_TIMEOUT = float(os.environ.get("USER_LOOKUP_TIMEOUT_MS", "200")) / 1000
+# Consecutive failed lookups before the breaker opens, and how long it stays open
+USER_BREAKER_THRESHOLD = int(os.environ.get("USER_BREAKER_THRESHOLD", "5"))
+USER_BREAKER_COOLDOWN = float(os.environ.get("USER_BREAKER_COOLDOWN", "10"))
+
+
+class UserNameCache:
+    """
+    user_id -> name cache in front of the users cluster (db_users.users).
+    Bounded LRU with TTL and negative entries; concurrent misses for the same
+    user_ids share one $in query. Lookups are capped by a timeout and a circuit
+    breaker, and degrade to "name unknown" instead of stalling the caller.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, collection, max_entries=USER_CACHE_SIZE, ttl_seconds=USER_CACHE_TTL,
+                 negative_ttl_seconds=USER_CACHE_NEGATIVE_TTL, timeout=USER_LOOKUP_TIMEOUT,
+                 breaker_threshold=USER_BREAKER_THRESHOLD, breaker_cooldown=USER_BREAKER_COOLDOWN):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.timeout = timeout
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.short_circuited = 0
+
+    def _put(self, user_id, name, ttl):
+        self._entries[user_id] = (name, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _allow_request(self):
+        if self._opened_at is None:
+            return True
+        if time.monotonic() - self._opened_at >= self.breaker_cooldown and not self._probing:
+            # Half-open: let a single lookup through to test the users cluster
+            self._probing = True
+            return True
+        return False
+
+    def _record(self, ok):
+        self._probing = False
+        if ok:
+            self._failures = 0
+            self._opened_at = None
+            return
+        self._failures += 1
+        if self._failures >= self.breaker_threshold:
+            self._opened_at = time.monotonic()
+
+    async def _load(self, user_ids):
+        try:
+            users = await asyncio.wait_for(
+                self.collection.find(
+                    {"user_id": {"$in": user_ids}},
+                    {"_id": 0, "user_id": 1, "name": 1}
+                ).max_time_ms(int(self.timeout * 1000)).to_list(),
+                timeout=self.timeout
+            )
+        except Exception as e:
+            self.errors += 1
+            self._record(False)
+            ERRORS.inc("user_cache")
+            print(f"Error fetching users ({len(user_ids)} ids): {e!r}")
+            return {}
+        finally:
+            for user_id in user_ids:
+                self._inflight.pop(user_id, None)
+
+        self._record(True)
+        names = {u["user_id"]: u.get("name") for u in users}
+        for user_id in user_ids:
+            if user_id in names:
+                self._put(user_id, names[user_id], self.ttl_seconds)
+            else:
+                self._put(user_id, None, self.negative_ttl_seconds)
+        return names
+
+    async def get_names(self, user_ids):
+        """{user_id: name} for the ids that resolve; unknown or unavailable ids are absent."""
+        names = {}
+        now = time.monotonic()
+        missing = []
+        for user_id in set(user_ids):
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                if entry[0] is not None:
+                    names[user_id] = entry[0]
+            else:
+                missing.append(user_id)
+        if not missing:
+            return names
+
+        waiting = {}
+        to_fetch = []
+        for user_id in missing:
+            task = self._inflight.get(user_id)
+            if task is not None:
+                self.coalesced += 1
+                waiting[user_id] = task
+            else:
+                to_fetch.append(user_id)
+
+        if to_fetch:
+            if self._allow_request():
+                self.misses += len(to_fetch)
+                task = asyncio.ensure_future(self._load(to_fetch))
+                for user_id in to_fetch:
+                    self._inflight[user_id] = task
+                    waiting[user_id] = task
+            else:
+                self.short_circuited += len(to_fetch)
+
+        for task in set(waiting.values()):
+            # Shield: one caller being cancelled must not cancel a shared lookup
+            await asyncio.shield(task)
+        for user_id, task in waiting.items():
+            name = task.result().get(user_id)
+            if name is not None:
+                names[user_id] = name
+        return names
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "short_circuited": self.short_circuited,
+            "breaker_open": self._opened_at is not None,
+        }
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+import weaviate
+
+from services.metrics import ERRORS
+
+WEAVIATE_HOST = "localhost"
+WEAVIATE_PORT = 8080
+WEAVIATE_GRPC_PORT = 50051
+# "weaviate", or "fake" for the load test's in-process stand-in (benchmarks/fake_vector_store.py)
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "weaviate")
+
+
+def connect():
+    return weaviate.connect_to_local(
+        host=WEAVIATE_HOST,
+        port=WEAVIATE_PORT,
+        grpc_port=WEAVIATE_GRPC_PORT,
+        headers={}
+    )
+
+
+def connect_async():
+    # Returned unconnected; caller must `await client.connect()`
+    if VECTOR_STORE == "fake":
+        from benchmarks.fake_vector_store import FakeAsyncClient
+        return FakeAsyncClient()
+    return weaviate.use_async_with_local(
+        host=WEAVIATE_HOST,
+        port=WEAVIATE_PORT,
+        grpc_port=WEAVIATE_GRPC_PORT,
+        headers={}
+    )
+
+
+class _Slot:
+    def __init__(self):
+        self.client = None
+        self.last_checked = 0.0
+
+
+class WeaviatePool:
+    """
+    Small fixed-size pool of long-lived Weaviate clients.
+    Each client owns one HTTP session + one gRPC channel, so `size` bounds
+    the number of concurrent gRPC channels the API process opens.
+    """
+
+    def __init__(self, size=4, health_check_interval=30.0, acquire_timeout=5.0):
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._slots = queue.Queue()
+        self._all_slots = []
+        self._lock = threading.Lock()
+        self._opened = False
+
+    def open(self):
+        with self._lock:
+            if self._opened:
+                return
+            for _ in range(self.size):
+                slot = _Slot()
+                # Connect eagerly, but let the app start if Weaviate is down;
+                # the slot reconnects on first use.
+                try:
+                    self._connect_slot(slot)
+                except Exception as e:
+                    ERRORS.inc("weaviate_pool")
+                    print(f"Weaviate pool: initial connect failed: {e}")
+                self._all_slots.append(slot)
+                self._slots.put(slot)
+            self._opened = True
+
+    def close(self):
+        with self._lock:
+            for slot in self._all_slots:
+                self._drop(slot)
+            self._all_slots = []
+            self._slots = queue.Queue()
+            self._opened = False
+
+    def _connect_slot(self, slot):
+        slot.client = connect()
+        slot.last_checked = time.monotonic()
+
+    def _drop(self, slot):
+        if slot.client is not None:
+            try:
+                slot.client.close()
+            except Exception:
+                pass
+        slot.client = None
+
+    def _ensure_healthy(self, slot):
+        if slot.client is None:
+            self._connect_slot(slot)
+            return
+        if time.monotonic() - slot.last_checked < self.health_check_interval:
+            return
+        try:
+            ready = slot.client.is_ready()
+        except Exception:
+            ready = False
+        if not ready:
+            self._drop(slot)
+            self._connect_slot(slot)
+        slot.last_checked = time.monotonic()
+
+    @contextmanager
+    def client(self):
+        if not self._opened:
+            self.open()
+        # Raises queue.Empty if every channel is busy for acquire_timeout
+        slot = self._slots.get(timeout=self.acquire_timeout)
+        try:
+            self._ensure_healthy(slot)
+            try:
+                yield slot.client
+            except Exception:
+                # Reconnect on the next acquire if the failure broke the connection
+                try:
+                    healthy = slot.client.is_ready()
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    self._drop(slot)
+                raise
+        finally:
+            self._slots.put(slot)
+
+
+class AsyncWeaviatePool:
+    """
+    asyncio counterpart of WeaviatePool built on WeaviateAsyncClient, used by
+    the async request path. Must be opened from inside the running event loop.
+    """
+
+    def __init__(self, size=4, health_check_interval=30.0, acquire_timeout=5.0):
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._slots = None
+        self._all_slots = []
+
+    async def open(self):
+        if self._slots is not None:
+            return
+        self._slots = asyncio.Queue()
+        for _ in range(self.size):
+            slot = _Slot()
+            try:
+                await self._connect_slot(slot)
+            except Exception as e:
+                ERRORS.inc("weaviate_pool")
+                print(f"Weaviate pool: initial connect failed: {e}")
+            self._all_slots.append(slot)
+            self._slots.put_nowait(slot)
+
+    async def close(self):
+        for slot in self._all_slots:
+            await self._drop(slot)
+        self._all_slots = []
+        self._slots = None
+
+    async def _connect_slot(self, slot):
+        client = connect_async()
+        await client.connect()
+        slot.client = client
+        slot.last_checked = time.monotonic()
+
+    async def _drop(self, slot):
+        if slot.client is not None:
+            try:
+                await slot.client.close()
+            except Exception:
+                pass
+        slot.client = None
+
+    async def _is_ready(self, slot):
+        try:
+            return await slot.client.is_ready()
+        except Exception:
+            return False
+
+    async def _ensure_healthy(self, slot):
+        if slot.client is None:
+            await self._connect_slot(slot)
+            return
+        if time.monotonic() - slot.last_checked < self.health_check_interval:
+            return
+        if not await self._is_ready(slot):
+            await self._drop(slot)
+            await self._connect_slot(slot)
+        slot.last_checked = time.monotonic()
+
+    @asynccontextmanager
+    async def client(self):
+        if self._slots is None:
+            await self.open()
+        # Raises asyncio.TimeoutError if every channel is busy for acquire_timeout
+        slot = await asyncio.wait_for(self._slots.get(), timeout=self.acquire_timeout)
+        try:
+            await self._ensure_healthy(slot)
+            try:
+                yield slot.client
+            except Exception:
+                if not await self._is_ready(slot):
+                    await self._drop(slot)
+                raise
+        finally:
+            self._slots.put_nowait(slot)
+
+
+# Shared pool for the API process, opened/closed by the app lifespan in main.py
+async_weaviate_pool = AsyncWeaviatePool()
@@ -1,7 +1,15 @@
-import weaviate
-from pymongo import MongoClient
-import ollama
+from weaviate.classes.data import DataObject
+from pymongo import MongoClient, UpdateOne
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
 import os
+import queue
+import threading
+import time
+from services.embeddings import get_provider
+from services.metrics import Counter, ERRORS, Gauge, Histogram, start_http_server
+from services.review_schema import REVIEW_COLLECTION, ensure_review_collection, review_properties, review_uuid
+from services.weaviate_pool import connect
 
 # Fix for segmentation fault in threaded environment
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -9,66 +17,439 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 # Setup Weaviate Client (v4)
 # w_client = weaviate.connect_to_local(...)
 
-# model = SentenceTransformer('all-MiniLM-L6-v2') 
+# model = SentenceTransformer('all-MiniLM-L6-v2')
 
 # mongo_client = MongoClient("mongodb://localhost:27017")
 # db = mongo_client.yelp_data
 
+# Pipeline tuning
+BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", "64"))
+FLUSH_INTERVAL = float(os.environ.get("SYNC_FLUSH_INTERVAL", "0.5"))  # seconds
+QUEUE_SIZE = int(os.environ.get("SYNC_QUEUE_SIZE", "5000"))
+EMBED_WORKERS = int(os.environ.get("SYNC_EMBED_WORKERS", "4"))
+REPORT_INTERVAL = float(os.environ.get("SYNC_REPORT_INTERVAL", "10"))
+# Prometheus scrape port for the worker (0 disables)
+SYNC_METRICS_PORT = int(os.environ.get("SYNC_METRICS_PORT", "9102"))
+
+# Resume tokens are persisted here so a restart continues where the last run stopped
+CHECKPOINT_ID = "weaviate_review_sync"
+CHECKPOINT_INTERVAL = float(os.environ.get("SYNC_CHECKPOINT_INTERVAL", "2"))
+
+# Failed batches are retried with exponential backoff before their reviews
+# go to the dead-letter collection, which the worker replays periodically
+MAX_RETRIES = int(os.environ.get("SYNC_MAX_RETRIES", "5"))
+RETRY_BACKOFF = float(os.environ.get("SYNC_RETRY_BACKOFF", "1"))  # seconds
+RETRY_BACKOFF_MAX = float(os.environ.get("SYNC_RETRY_BACKOFF_MAX", "30"))
+DEAD_LETTER_COLLECTION = "sync_dead_letters"
+DEAD_LETTER_REPLAY_INTERVAL = float(os.environ.get("SYNC_DEAD_LETTER_REPLAY_INTERVAL", "300"))
+
+# Server-side filter: only review inserts, only the fields the indexer uses
+CHANGE_STREAM_PIPELINE = [
+    {"$match": {"operationType": "insert"}},
+    {"$project": {
+        "operationType": 1,
+        "clusterTime": 1,
+        "wallTime": 1,
+        "fullDocument._id": 1,
+        "fullDocument.business_id": 1,
+        "fullDocument.text": 1,
+        "fullDocument.location": 1
+    }}
+]
+
+_STOP = object()
+
+SYNC_REVIEWS = Counter("sync_reviews_total", "Reviews handled by the sync worker.", ("outcome",))
+SYNC_LAG_SECONDS = Gauge("sync_lag_seconds", "Commit-to-searchable lag of the last indexed batch.")
+SYNC_BATCH_STAGE_SECONDS = Histogram(
+    "sync_batch_stage_duration_seconds", "Time per indexing batch stage.", ("stage",))
+
+def business_locations(db, business_ids):
+    # Reviews written before location enrichment lack 'location'; use the business's
+    if not business_ids:
+        return {}
+    businesses = db.businesses.find(
+        {"business_id": {"$in": list(business_ids)}},
+        {"business_id": 1, "location": 1}
+    )
+    return {b["business_id"]: b.get("location") for b in businesses}
+
+def event_time(change):
+    """Wall-clock seconds at which the change was committed in MongoDB."""
+    wall_time = change.get("wallTime")
+    if wall_time is not None:
+        return wall_time.replace(tzinfo=timezone.utc).timestamp()
+    return float(change["clusterTime"].time)
+
+
+def load_resume_token(db):
+    checkpoint = db.sync_checkpoints.find_one({"_id": CHECKPOINT_ID})
+    return checkpoint.get("resume_token") if checkpoint else None
+
+def save_resume_token(db, token):
+    db.sync_checkpoints.replace_one(
+        {"_id": CHECKPOINT_ID},
+        {"_id": CHECKPOINT_ID, "resume_token": token, "updated_at": time.time()},
+        upsert=True
+    )
+
+
+def save_dead_letters(db, docs, errors):
+    db[DEAD_LETTER_COLLECTION].bulk_write([
+        UpdateOne(
+            {"_id": d["_id"]},
+            {"$set": {"business_id": d.get("business_id"), "error": errors[d["_id"]], "failed_at": time.time()},
+             "$inc": {"attempts": 1}},
+            upsert=True
+        )
+        for d in docs
+    ], ordered=False)
+
+
+class CheckpointTracker:
+    """
+    Resume token of the newest event such that it and every event before it
+    have been indexed. Batches finish out of order, so the token only
+    advances over a contiguous prefix of completed events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._pending = {}
+        self._done = set()
+        self._low = 0
+        self.token = None
+        self.dirty = False
+
+    def register(self, token):
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending[seq] = token
+            return seq
+
+    def complete(self, seqs):
+        with self._lock:
+            self._done.update(seqs)
+            while self._low in self._done:
+                self._done.remove(self._low)
+                self.token = self._pending.pop(self._low)
+                self.dirty = True
+                self._low += 1
+
+    def take(self):
+        """Token to persist, or None if nothing advanced since the last take."""
+        with self._lock:
+            if not self.dirty:
+                return None
+            self.dirty = False
+            return self.token
+
+    def retry(self):
+        """Hand the current token out again on the next take (its save failed)."""
+        with self._lock:
+            self.dirty = True
+
+
+class IndexerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.indexed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.batches = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def record_batch(self, indexed, failed, lag):
+        with self._lock:
+            self.batches += 1
+            self.indexed += indexed
+            self.failed += failed
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+        SYNC_REVIEWS.inc("indexed", amount=indexed)
+        SYNC_REVIEWS.inc("dead_lettered", amount=failed)
+        if indexed:
+            SYNC_LAG_SECONDS.set(lag)
+
+    def record_skipped(self):
+        with self._lock:
+            self.skipped += 1
+        SYNC_REVIEWS.inc("skipped")
+
+    def snapshot(self, queue_depth):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "indexed": self.indexed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "batches": self.batches,
+                "throughput_per_s": self.indexed / elapsed if elapsed else 0.0,
+                "queue_depth": queue_depth,
+                "last_lag_s": self.last_lag,
+                "max_lag_s": self.max_lag,
+            }
+
+
+class ReviewIndexer:
+    """
+    Change events -> bounded queue -> micro-batches (by size or time)
+    -> batched embedding on a worker pool -> Weaviate batch insert.
+    submit() blocks when the queue is full, which back-pressures the change
+    stream reader instead of buffering without bound.
+    """
+
+    def __init__(self, db, reviews_collection, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE,
+                 embed_workers=EMBED_WORKERS):
+        self.db = db
+        self.reviews_collection = reviews_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=embed_workers)
+        # At most one queued batch per worker on top of the running ones
+        self._inflight = threading.Semaphore(embed_workers * 2)
+        self.stats = IndexerStats()
+        self.checkpoints = CheckpointTracker()
+        # Set when a batch fails outside the retry/dead-letter path; its events
+        # can never be checkpointed, so the stream stops and a restart replays them
+        self.failed = threading.Event()
+        Gauge("sync_queue_depth", "Change events waiting to be batched.", function=self.queue.qsize)
+        self._batcher = threading.Thread(target=self._run_batcher, name="review-batcher", daemon=True)
+
+    def start(self):
+        self._batcher.start()
+
+    def submit(self, doc, committed_at, resume_token):
+        if self.failed.is_set():
+            raise RuntimeError("an indexing batch failed; stopping at the last checkpoint")
+        seq = self.checkpoints.register(resume_token)
+        if not doc.get("text"):
+            self.stats.record_skipped()
+            self.checkpoints.complete([seq])
+            return
+        self.queue.put((doc, committed_at, seq))
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self._batcher.join()
+        self.executor.shutdown(wait=True)
+
+    def _run_batcher(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._inflight.acquire()
+            self.executor.submit(self._index_batch, batch)
+            if stopping:
+                return
+
+    def _index_docs(self, docs):
+        """One attempt at embedding and inserting docs; {_id: error} for those not indexed."""
+        started = time.perf_counter()
+        try:
+            vectors = get_provider().embed([d["text"] for d in docs])
+        except Exception as e:
+            ERRORS.inc("sync_embed")
+            return {d["_id"]: f"embedding failed: {e}" for d in docs}
+        embedded = time.perf_counter()
+        SYNC_BATCH_STAGE_SECONDS.observe(embedded - started, "embed")
+
+        try:
+            missing = {d["business_id"] for d in docs if not d.get("location")}
+            locations = business_locations(self.db, missing)
+            objects = [
+                DataObject(
+                    uuid=review_uuid(d["_id"]),
+                    properties=review_properties(d, d.get("location") or locations.get(d["business_id"])),
+                    vector=vectors[i]
+                )
+                for i, d in enumerate(docs)
+            ]
+            result = self.reviews_collection.data.insert_many(objects)
+        except Exception as e:
+            ERRORS.inc("sync_insert")
+            return {d["_id"]: f"insert failed: {e}" for d in docs}
+        SYNC_BATCH_STAGE_SECONDS.observe(time.perf_counter() - embedded, "insert")
+        return {docs[index]["_id"]: error.message for index, error in result.errors.items()}
+
+    def _index_batch(self, batch):
+        try:
+            docs = [doc for doc, _, _ in batch]
+            # Deterministic UUIDs make re-inserting an already indexed review a no-op overwrite
+            pending = docs
+            delay = RETRY_BACKOFF
+            for attempt in range(MAX_RETRIES + 1):
+                errors = self._index_docs(pending)
+                pending = [d for d in pending if d["_id"] in errors]
+                if not pending or attempt == MAX_RETRIES:
+                    break
+                SYNC_REVIEWS.inc("retried", amount=len(pending))
+                print(f"Error indexing {len(pending)} of {len(docs)} reviews "
+                      f"(first: {pending[0]['_id']}: {errors[pending[0]['_id']]}), retrying in {delay:.0f}s")
+                # Blocking this worker back-pressures the change stream during an outage
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_BACKOFF_MAX)
+
+            if pending:
+                self._dead_letter(pending, errors)
+                print(f"Dead-lettered {len(pending)} reviews after {MAX_RETRIES} retries "
+                      f"(first: {pending[0]['_id']}: {errors[pending[0]['_id']]})")
+
+            # Lag of the oldest event in the batch: commit time -> searchable
+            lag = time.time() - min(committed_at for _, committed_at, _ in batch)
+            self.stats.record_batch(len(docs) - len(pending), len(pending), lag)
+            # Every review is now indexed or in the dead-letter collection
+            self.checkpoints.complete([seq for _, _, seq in batch])
+        except Exception as e:
+            ERRORS.inc("sync_batch")
+            print(f"Error indexing batch of {len(batch)} reviews, stopping the change stream: {e}")
+            self.failed.set()
+        finally:
+            self._inflight.release()
+
+    def _dead_letter(self, docs, errors):
+        """
+        Save docs to the dead-letter collection, retrying until MongoDB takes
+        the write: the batch can't be checkpointed until every review is
+        indexed or dead-lettered.
+        """
+        delay = RETRY_BACKOFF
+        while True:
+            try:
+                save_dead_letters(self.db, docs, errors)
+                return
+            except Exception as e:
+                ERRORS.inc("sync_dead_letter")
+                print(f"Error dead-lettering {len(docs)} reviews, retrying in {delay:.0f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_BACKOFF_MAX)
+
+    def replay_dead_letters(self):
+        """Retry dead-lettered reviews once each; drop the entries that are indexed now."""
+        ids = [entry["_id"] for entry in self.db[DEAD_LETTER_COLLECTION].find({}, {"_id": 1})]
+        replayed = 0
+        for start in range(0, len(ids), self.batch_size):
+            chunk = ids[start:start + self.batch_size]
+            docs = list(self.db.reviews.find(
+                {"_id": {"$in": chunk}}, {"business_id": 1, "text": 1, "location": 1}
+            ))
+            docs = [d for d in docs if d.get("text")]
+            errors = self._index_docs(docs) if docs else {}
+            if errors:
+                save_dead_letters(self.db, [d for d in docs if d["_id"] in errors], errors)
+            # Indexed, deleted from MongoDB meanwhile, or without text
+            done = [_id for _id in chunk if _id not in errors]
+            self.db[DEAD_LETTER_COLLECTION].delete_many({"_id": {"$in": done}})
+            replayed += len(docs) - len(errors)
+        if ids:
+            print(f"Replayed {replayed} of {len(ids)} dead-lettered reviews.")
+            SYNC_REVIEWS.inc("replayed", amount=replayed)
+
+    def report(self):
+        s = self.stats.snapshot(self.queue.qsize())
+        print(
+            f"Indexed {s['indexed']} ({s['throughput_per_s']:.1f}/s), dead-lettered {s['failed']}, "
+            f"queue {s['queue_depth']}, lag {s['last_lag_s']:.2f}s (max {s['max_lag_s']:.2f}s)"
+        )
+
+
+def _checkpoint(db, indexer):
+    token = indexer.checkpoints.take()
+    if token is not None:
+        try:
+            save_resume_token(db, token)
+        except Exception as e:
+            # Keep the token so the next attempt persists it
+            indexer.checkpoints.retry()
+            ERRORS.inc("sync_checkpoint")
+            print(f"Error saving resume token: {e}")
+
+def _replay(indexer):
+    try:
+        indexer.replay_dead_letters()
+    except Exception as e:
+        ERRORS.inc("sync_replay")
+        print(f"Error replaying dead-lettered reviews: {e}")
+
+def _background(db, indexer, stop_event):
+    last_report = time.monotonic()
+    # Replay once at startup, then periodically
+    last_replay = time.monotonic() - DEAD_LETTER_REPLAY_INTERVAL
+    while not stop_event.wait(CHECKPOINT_INTERVAL):
+        _checkpoint(db, indexer)
+        if time.monotonic() - last_report >= REPORT_INTERVAL:
+            indexer.report()
+            last_report = time.monotonic()
+        if time.monotonic() - last_replay >= DEAD_LETTER_REPLAY_INTERVAL:
+            _replay(indexer)
+            last_replay = time.monotonic()
+
 def process_change_stream():
     print("Initializing clients in background thread...")
-    
+
     mongo_client = MongoClient("mongodb://localhost:27017")
     db = mongo_client.yelp_data
-    
-    w_client = weaviate.connect_to_local(
-        port=8080,
-        grpc_port=50051, 
-        headers={}
-    )
-    
-    print("Using Ollama for embeddings (model: all-minilm)...")
-    print("Listening for changes in Reviews...")
+
+    w_client = connect()
+
+    print(f"Using embeddings from {get_provider().name}...")
+    if SYNC_METRICS_PORT:
+        start_http_server(SYNC_METRICS_PORT)
+        print(f"Serving metrics on :{SYNC_METRICS_PORT}/metrics")
+    print(f"Listening for changes in Reviews (indexing into '{REVIEW_COLLECTION}')...")
+    indexer = None
+    stop_reporting = threading.Event()
     try:
         # Create collection if not exists
-        if not w_client.collections.exists("Review"):
-            from weaviate.classes.config import Configure
-            w_client.collections.create(
-                "Review",
-                vectorizer_config=Configure.Vectorizer.none()
-            )
-            
-        reviews_collection = w_client.collections.get("Review")
-
-        # Watch the database
-        with db.watch() as stream:
+        reviews_collection = ensure_review_collection(w_client)
+
+        indexer = ReviewIndexer(db, reviews_collection)
+        indexer.start()
+        threading.Thread(
+            target=_background, args=(db, indexer, stop_reporting), daemon=True
+        ).start()
+
+        # Watch review inserts, resuming after the last checkpointed event
+        resume_token = load_resume_token(db)
+        if resume_token is not None:
+            print("Resuming change stream from saved checkpoint...")
+        with db.reviews.watch(CHANGE_STREAM_PIPELINE, start_after=resume_token) as stream:
             for change in stream:
-                print(f"Received change: {change['operationType']} on {change['ns']}")
-                if change["operationType"] == "insert" and change["ns"]["coll"] == "reviews":
-                    doc = change["fullDocument"]
-                    
-                    # 1. Generate Embedding
-                    review_text = doc.get("text", "")
-                    try:
-                        response = ollama.embed(model='all-minilm', input=review_text)
-                        vector = response['embeddings'][0]
-                    except Exception as e:
-                        print(f"Error generating embedding with Ollama: {e}")
-                        continue
-                    
-                    # 2. Push to Weaviate 
-                    reviews_collection.data.insert(
-                        properties={
-                            "review_id": str(doc["_id"]),
-                            "business_id": doc["business_id"],
-                            "text": review_text
-                        },
-                        vector=vector
-                    )
-                    print(f"Indexed review {doc['_id']}")
+                indexer.submit(change["fullDocument"], event_time(change), change["_id"])
     except Exception as e:
+        ERRORS.inc("sync_worker")
         print(f"Error in sync worker: {e}")
     finally:
+        stop_reporting.set()
+        if indexer is not None:
+            # Drain what was already received before closing the client
+            indexer.stop()
+            _checkpoint(db, indexer)
+            indexer.report()
         w_client.close()
+        mongo_client.close()
 
 if __name__ == "__main__":
-    process_change_stream()
\ No newline at end of file
+    process_change_stream()